@@ -2,13 +2,23 @@
 ai.py — Google Gemini integration for food recognition
 """
 
+import asyncio
+import hashlib
 import json
+import random
 import re
 import logging
+import time
+from collections import deque
+from collections.abc import AsyncIterator
 from pathlib import Path
 
 from google import genai
-from google.genai import types
+from google.genai import errors, types
+
+from cache import MISS, PhotoCache, TTLCache
+from imaging import dhash
+from search import normalize_name
 
 logger = logging.getLogger(__name__)
 
@@ -27,37 +37,362 @@ SYSTEM_PROMPT = """Ты профессиональный диетолог и н
 6. Если на изображении нет еды или текст не описывает еду — верни: null
 7. Если описание неоднозначно, используй наиболее типичный рецепт."""
 
+# Variant for batched text requests: several descriptions in, one JSON array out.
+BATCH_SYSTEM_PROMPT = SYSTEM_PROMPT.split("\n\nПравила:")[0] + """
+На вход приходит JSON-массив текстовых описаний; обработай каждое независимо.
 
-def _parse_ai_response(raw: str) -> dict | None:
-    """Extract and parse JSON from AI response, strip markdown fences if any."""
+Правила:
+1. Верни ТОЛЬКО валидный JSON-массив той же длины и в том же порядке, без markdown, без пояснений.
+2. Каждый элемент массива:
+   {"food": "Название блюда", "calories": 350, "protein": 25.0, "carbs": 40.0, "fat": 8.0, "emoji": "🍗"}
+3. "calories" — целое число, ккал на порцию (стандартная порция ~250-400г).
+4. "protein", "carbs", "fat" — граммы на порцию, число с плавающей точкой.
+5. "emoji" — один эмодзи, лучше всего описывающий блюдо.
+6. Если текст не описывает еду — на его месте верни null.
+7. Если описание неоднозначно, используй наиболее типичный рецепт."""
+
+# Part of every cache key, so editing the prompts invalidates old answers.
+PROMPT_VERSION = hashlib.sha1((SYSTEM_PROMPT + BATCH_SYSTEM_PROMPT).encode("utf-8")).hexdigest()[:8]
+
+
+def normalize_text(text: str) -> str:
+    """Cache-key form of a food description: search normalization, single spaces, no trailing punctuation."""
+    return " ".join(normalize_name(text).split()).strip(" .,!?;")
+
+
+def _strip_fences(raw: str) -> str:
     text = raw.strip()
     # Remove ```json ... ``` or ``` ... ```
     text = re.sub(r"^```(?:json)?\s*", "", text, flags=re.MULTILINE)
     text = re.sub(r"\s*```$", "", text, flags=re.MULTILINE)
-    text = text.strip()
+    return text.strip()
+
+
+class AIParseError(ValueError):
+    """Gemini's answer was not the expected JSON — unlike an explicit null, this says nothing about the food."""
+
+
+def _check_food(data) -> dict | None:
+    if data is None:
+        return None
+    if not isinstance(data, dict) or "food" not in data or "calories" not in data:
+        logger.warning("Unexpected AI JSON shape: %s", data)
+        raise AIParseError(f"Unexpected AI JSON shape: {str(data)[:100]}")
+    return data
+
+
+def _parse_ai_response(raw: str) -> dict | None:
+    """
+    Extract and parse JSON from AI response, strip markdown fences if any.
+    Returns None only for an explicit null ("not food"); raises AIParseError
+    for malformed, truncated or wrongly shaped answers.
+    """
+    text = _strip_fences(raw)
 
     if text.lower() == "null":
         return None
 
     try:
         data = json.loads(text)
-        if data is None:
-            return None
-        if not isinstance(data, dict) or "food" not in data or "calories" not in data:
-            logger.warning("Unexpected AI JSON shape: %s", data)
-            return None
-        return data
     except json.JSONDecodeError as e:
         logger.error("JSON parse error: %s | raw: %s", e, raw[:300])
+        raise AIParseError(str(e)) from e
+    return _check_food(data)
+
+
+def _parse_batch_response(raw: str, count: int) -> list[dict | None | AIParseError] | None:
+    """
+    Parse a batched answer; None unless it is a JSON array with `count` items.
+    Items that aren't a food object or null come back as AIParseError instances.
+    """
+    try:
+        data = json.loads(_strip_fences(raw))
+    except json.JSONDecodeError as e:
+        logger.error("Batch JSON parse error: %s | raw: %s", e, raw[:300])
         return None
+    if not isinstance(data, list) or len(data) != count:
+        logger.warning("Batch answer is not a %d-item array: %s", count, raw[:300])
+        return None
+
+    results = []
+    for item in data:
+        try:
+            results.append(_check_food(item))
+        except AIParseError as e:
+            results.append(e)
+    return results
+
+
+class StreamingFoodParser:
+    """
+    Incremental parser for a streamed answer. feed() takes text chunks as they
+    arrive and returns the top-level fields of the JSON object whose values
+    completed in that chunk; `done` is set as soon as the object closes (or
+    the answer is null), so the rest of the stream can be dropped.
+    """
+
+    def __init__(self):
+        self._buf = ""
+        self._pos = 0
+        self._start: int | None = None  # index of the opening "{"
+        self._field_start = 0
+        self._depth = 0
+        self._in_string = False
+        self._escape = False
+        self.done = False
+        self.result: dict | None = None
+
+    def feed(self, chunk: str) -> dict:
+        if self.done:
+            return {}
+        self._buf += chunk
+        if self._start is None:
+            self._start = self._buf.find("{")
+            if self._start < 0:
+                self._start = None
+                if _strip_fences(self._buf).lower().startswith("null"):
+                    self.done = True
+                return {}
+            self._pos = self._start
+
+        fields = {}
+        buf = self._buf
+        for i in range(self._pos, len(buf)):
+            c = buf[i]
+            if self._in_string:
+                if self._escape:
+                    self._escape = False
+                elif c == "\\":
+                    self._escape = True
+                elif c == '"':
+                    self._in_string = False
+            elif c == '"':
+                self._in_string = True
+            elif c in "{[":
+                self._depth += 1
+                if self._depth == 1:
+                    self._field_start = i + 1
+            elif c in "}]":
+                self._depth -= 1
+                if self._depth == 0:
+                    self._add_field(buf[self._field_start:i], fields)
+                    self.done = True
+                    self.result = _parse_ai_response(buf[self._start:i + 1])
+                    break
+            elif c == "," and self._depth == 1:
+                self._add_field(buf[self._field_start:i], fields)
+                self._field_start = i + 1
+        self._pos = len(buf)
+        return fields
+
+    @staticmethod
+    def _add_field(segment: str, fields: dict) -> None:
+        if not segment.strip():
+            return
+        try:
+            fields.update(json.loads("{" + segment + "}"))
+        except json.JSONDecodeError:
+            pass
+
+    def finish(self) -> dict | None:
+        """Result once the stream has ended, parsing whatever arrived if the object never closed."""
+        return self.result if self.done else _parse_ai_response(self._buf)
+
+
+class PartialFeed:
+    """
+    Partial fields of one in-flight streamed answer. Every caller sharing the
+    answer follows the same feed, so a late joiner first replays what has
+    already arrived.
+    """
+
+    def __init__(self):
+        self.fields: list[dict] = []
+        self._changed = asyncio.Event()
+
+    def publish(self, fields: dict) -> None:
+        self.fields.append(fields)
+        self.wake()
+
+    def wake(self) -> None:
+        self._changed.set()
+        self._changed = asyncio.Event()
+
+    async def follow(self, task: asyncio.Task) -> AsyncIterator[dict]:
+        """Yield partial fields until the task producing them is done."""
+        i = 0
+        while True:
+            while i < len(self.fields):
+                yield self.fields[i]
+                i += 1
+            if task.done():
+                return
+            await self._changed.wait()
+
+
+# ─────────────────────────── Scheduling ───────────────────────────
+
+# Gemini status codes worth retrying: rate limited / overloaded.
+RETRY_CODES = {429, 503}
+
+
+class AIUnavailable(Exception):
+    """Gemini didn't answer in time or stayed rate-limited/overloaded after all retries."""
+
+
+class TokenBucket:
+    """
+    Allows `rate` calls per second on average with bursts of up to `burst`.
+    Callers reserve a token immediately and sleep off any deficit, so waiters
+    are served in arrival order. rate <= 0 disables the limit.
+    """
+
+    def __init__(self, rate: float, burst: int):
+        self.rate = rate
+        self.burst = burst
+        self._tokens = float(burst)
+        self._updated = time.monotonic()
+
+    async def acquire(self) -> None:
+        if self.rate <= 0:
+            return
+        now = time.monotonic()
+        self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+        self._tokens -= 1
+        if self._tokens < 0:
+            await asyncio.sleep(-self._tokens / self.rate)
+
+
+class GeminiScheduler:
+    """
+    Runs Gemini calls through a token bucket and a concurrency limit, with a
+    timeout per call and jittered exponential backoff on 429/503.
+    With `hedge`, a second identical call is fired when the first hasn't
+    answered within the recent p95 latency; whichever finishes first wins.
+    """
+
+    def __init__(
+        self,
+        *,
+        rate: float = 0,
+        burst: int = 10,
+        concurrency: int = 8,
+        timeout: float = 20.0,
+        max_retries: int = 3,
+        backoff: float = 0.5,
+        max_backoff: float = 8.0,
+        hedge: bool = False,
+    ):
+        self.bucket = TokenBucket(rate, burst)
+        self.timeout = timeout
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.hedge = hedge
+        self._slots = asyncio.Semaphore(concurrency)
+        self._latencies: deque[float] = deque(maxlen=200)
+        self.in_flight = 0
+        self.retries = 0
+        self.hedged = 0
+        self.timeouts = 0
+
+    def p95(self) -> float | None:
+        """p95 of recent successful call latencies, once there are enough samples."""
+        if len(self._latencies) < 20:
+            return None
+        ordered = sorted(self._latencies)
+        return ordered[int(0.95 * (len(ordered) - 1))]
+
+    async def run(self, make_call):
+        """Await `make_call()` (a fresh coroutine per attempt) under the limits above."""
+        for attempt in range(self.max_retries + 1):
+            try:
+                return await self._attempt(make_call)
+            except TimeoutError as e:
+                self.timeouts += 1
+                raise AIUnavailable(f"Gemini did not answer within {self.timeout:g}s") from e
+            except errors.APIError as e:
+                if e.code not in RETRY_CODES:
+                    raise
+                if attempt == self.max_retries:
+                    raise AIUnavailable(f"Gemini returned {e.code} after {attempt + 1} attempts") from e
+                # Full jitter: spread retries of a burst instead of re-synchronizing them
+                delay = random.uniform(0, min(self.max_backoff, self.backoff * 2 ** attempt))
+                self.retries += 1
+                logger.warning("Gemini %s, retrying in %.2fs", e.code, delay)
+                await asyncio.sleep(delay)
+
+    async def _attempt(self, make_call):
+        pending = {asyncio.create_task(self._call(make_call))}
+        try:
+            hedge_after = self.p95() if self.hedge else None
+            if hedge_after is not None:
+                done, _ = await asyncio.wait(pending, timeout=hedge_after)
+                if not done:
+                    self.hedged += 1
+                    pending.add(asyncio.create_task(self._call(make_call)))
+
+            error = None
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None:
+                        return task.result()
+                    error = task.exception()
+            raise error
+        finally:
+            for task in pending:
+                task.cancel()
+
+    async def _call(self, make_call):
+        await self.bucket.acquire()
+        async with self._slots:
+            self.in_flight += 1
+            start = time.monotonic()
+            try:
+                result = await asyncio.wait_for(make_call(), self.timeout)
+            finally:
+                self.in_flight -= 1
+            self._latencies.append(time.monotonic() - start)
+            return result
+
+    def stats(self) -> dict:
+        p95 = self.p95()
+        return {
+            "in_flight": self.in_flight,
+            "retries": self.retries,
+            "hedged": self.hedged,
+            "timeouts": self.timeouts,
+            "p95_ms": round(p95 * 1000) if p95 is not None else None,
+        }
 
 
 class FoodAI:
-    def __init__(self, api_key: str, model: str = "gemini-2.5-flash-lite"):
+    def __init__(
+        self,
+        api_key: str,
+        model: str = "gemini-2.5-flash-lite",
+        cache: TTLCache | None = None,
+        photo_cache: PhotoCache | None = None,
+        scheduler: GeminiScheduler | None = None,
+        batch_window_ms: float = 0,
+        batch_size: int = 16,
+    ):
         if not api_key:
             raise ValueError("GEMINI_API_KEY is not set! The AI cannot function without it.")
         self.model = model
         self.client = genai.Client(api_key=api_key)
+        self.cache = cache
+        self.photo_cache = photo_cache
+        self.scheduler = scheduler or GeminiScheduler()
+        self._inflight: dict[str, tuple[asyncio.Task, PartialFeed | None]] = {}
+        # Text requests arriving within batch_window_ms share one Gemini call (0 = off)
+        self.batch_window = batch_window_ms / 1000
+        self.batch_size = batch_size
+        self._batch: list[tuple[str, asyncio.Future]] = []
+        self._batch_timer: asyncio.TimerHandle | None = None
+        self._batch_tasks: set[asyncio.Task] = set()
 
     # ── Text analysis ──────────────────────────────────────────────
 
@@ -66,34 +401,218 @@ class FoodAI:
         Send a text description to Gemini and get food info.
         Returns dict with keys: food, calories, protein, carbs, fat, emoji
         Returns None if not food-related.
+
+        Answers are cached by normalized text, model and prompt version, and
+        concurrent identical requests share a single Gemini call. An
+        unparseable answer also returns None but is never cached.
         """
-        prompt = text
         try:
-            response = await self.client.aio.models.generate_content(
+            key = self._text_key(text)
+            if self.cache is not None:
+                cached = await self.cache.aget(key)
+                if cached is not MISS:
+                    return cached
+
+            task, _ = self._join(key, text)
+            # Shielded so one caller disconnecting doesn't cancel the call for the others
+            return await asyncio.shield(task)
+        except AIParseError:
+            return None
+
+    async def stream_text(self, text: str) -> AsyncIterator[tuple[str, dict | None]]:
+        """
+        Like analyze_text, but yields ("partial", fields) as the answer streams
+        in (food name first, then calories and macros) and ends with
+        ("result", food or None). Concurrent identical requests share one
+        stream; with batching on there are no partials, only the result.
+        """
+        key = self._text_key(text)
+        if self.cache is not None:
+            cached = await self.cache.aget(key)
+            if cached is not MISS:
+                yield "result", cached
+                return
+
+        task, feed = self._join(key, text)
+        try:
+            if feed is not None:
+                async for fields in feed.follow(task):
+                    yield "partial", fields
+            yield "result", await asyncio.shield(task)
+        except AIParseError:
+            yield "result", None
+
+    def _text_key(self, text: str) -> str:
+        return f"text:{self.model}:{PROMPT_VERSION}:{normalize_text(text)}"
+
+    def _join(self, key: str, text: str) -> tuple[asyncio.Task, PartialFeed | None]:
+        """Return the in-flight call for this key, starting one if there is none."""
+        entry = self._inflight.get(key)
+        if entry is None:
+            # Batched calls answer many texts at once, so they can't stream partials
+            feed = PartialFeed() if self.batch_window <= 0 else None
+            task = asyncio.create_task(self._generate_text_cached(key, text, feed))
+            entry = self._inflight[key] = (task, feed)
+            task.add_done_callback(lambda _: self._inflight.pop(key, None))
+            if feed is not None:
+                task.add_done_callback(lambda _: feed.wake())
+        return entry
+
+    async def _generate_text_cached(self, key: str, text: str, feed: PartialFeed | None = None) -> dict | None:
+        # AIParseError propagates, so only an explicit null is negative-cached
+        result = await self._generate_text(text, feed)
+        if self.cache is not None:
+            if result is None:
+                await self.cache.aset_negative(key)
+            else:
+                await self.cache.aset(key, result)
+        return result
+
+    async def _generate_text(self, text: str, feed: PartialFeed | None = None) -> dict | None:
+        if self.batch_window <= 0:
+            return await self._generate_one(text, feed)
+
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self._batch.append((text, future))
+        if len(self._batch) >= self.batch_size:
+            self._flush_batch()
+        elif self._batch_timer is None:
+            self._batch_timer = loop.call_later(self.batch_window, self._flush_batch)
+        return await future
+
+    def _flush_batch(self) -> None:
+        if self._batch_timer is not None:
+            self._batch_timer.cancel()
+            self._batch_timer = None
+        batch, self._batch = self._batch, []
+        if batch:
+            task = asyncio.create_task(self._run_batch(batch))
+            self._batch_tasks.add(task)
+            task.add_done_callback(self._batch_tasks.discard)
+
+    async def _run_batch(self, batch: list[tuple[str, asyncio.Future]]) -> None:
+        """Answer a batch with one call, falling back to one call per text if the array is unusable."""
+        texts = [text for text, _ in batch]
+        try:
+            results = await self._generate_batch(texts) if len(texts) > 1 else None
+            if results is None:
+                results = await asyncio.gather(*(self._generate_one(t) for t in texts), return_exceptions=True)
+        except Exception as e:
+            results = [e] * len(batch)
+
+        for (_, future), result in zip(batch, results):
+            if future.done():  # caller went away
+                continue
+            if isinstance(result, Exception):
+                future.set_exception(result)
+            else:
+                future.set_result(result)
+
+    async def _generate_batch(self, texts: list[str]) -> list[dict | None] | None:
+        try:
+            response = await self.scheduler.run(lambda: self.client.aio.models.generate_content(
+                model=self.model,
+                contents=json.dumps(texts, ensure_ascii=False),
+                config=types.GenerateContentConfig(
+                    system_instruction=BATCH_SYSTEM_PROMPT,
+                    temperature=0.2,
+                    max_output_tokens=256 * len(texts),
+                ),
+            ))
+            raw = response.text or ""
+            return _parse_batch_response(raw, len(texts))
+        except Exception as e:
+            logger.error("Gemini batch error (%d texts): %s", len(texts), e)
+            raise
+
+    async def _generate_one(self, text: str, feed: PartialFeed | None = None) -> dict | None:
+        async for kind, value in self._stream_one(text):
+            if kind == "result":
+                return value
+            if feed is not None:
+                feed.publish(value)
+        return None
+
+    async def _stream_one(self, text: str) -> AsyncIterator[tuple[str, dict | None]]:
+        """
+        Stream one answer through StreamingFoodParser and stop reading as soon
+        as the JSON object is complete. Opening the stream and its first chunk
+        go through the scheduler (retries, rate limit, per-attempt timeout);
+        the rest of the answer must then arrive within the scheduler's timeout,
+        counted from the first chunk so queueing doesn't eat into it.
+        """
+        async def open_stream():
+            stream = await self.client.aio.models.generate_content_stream(
                 model=self.model,
-                contents=prompt,
+                contents=text,
                 config=types.GenerateContentConfig(
                     system_instruction=SYSTEM_PROMPT,
                     temperature=0.2,
                     max_output_tokens=256,
                 ),
             )
-            raw = response.text or ""
-            return _parse_ai_response(raw)
+            return stream, await anext(stream, None)
+
+        loop = asyncio.get_running_loop()
+        stream = None
+        try:
+            stream, chunk = await self.scheduler.run(open_stream)
+            deadline = loop.time() + self.scheduler.timeout
+            parser = StreamingFoodParser()
+            while chunk is not None:
+                fields = parser.feed(chunk.text or "")
+                if fields:
+                    yield "partial", fields
+                if parser.done:
+                    break
+                try:
+                    chunk = await asyncio.wait_for(anext(stream, None), deadline - loop.time())
+                except TimeoutError as e:
+                    self.scheduler.timeouts += 1
+                    raise AIUnavailable("Gemini stream did not finish in time") from e
+            yield "result", parser.finish()
         except Exception as e:
             logger.error("Gemini text error: %s", e)
             raise
+        finally:
+            if stream is not None:
+                await stream.aclose()
 
     # ── Photo analysis ─────────────────────────────────────────────
 
-    async def analyze_photo(self, image_bytes: bytes, mime_type: str = "image/jpeg") -> dict | None:
+    async def analyze_photo(
+        self, image_bytes: bytes, mime_type: str = "image/jpeg", phash: int | None = None
+    ) -> dict | None:
         """
         Send an image to Gemini and get food info.
         Returns dict with keys: food, calories, protein, carbs, fat, emoji
         Returns None if the image doesn't contain food.
+
+        Identical and near-duplicate photos (by SHA-256, then perceptual hash)
+        are answered from the photo cache; pass `phash` if it is already known.
+        Unparseable answers return None without being cached.
         """
         try:
-            response = await self.client.aio.models.generate_content(
+            if self.photo_cache is None:
+                return await self._generate_photo(image_bytes, mime_type)
+
+            digest = hashlib.sha256(image_bytes).hexdigest()
+            if phash is None:
+                phash = await asyncio.to_thread(dhash, image_bytes)
+            cached = self.photo_cache.get(digest, phash)
+            if cached is not MISS:
+                return cached
+
+            result = await self._generate_photo(image_bytes, mime_type)
+            self.photo_cache.set(digest, phash, result)
+            return result
+        except AIParseError:
+            return None
+
+    async def _generate_photo(self, image_bytes: bytes, mime_type: str) -> dict | None:
+        try:
+            response = await self.scheduler.run(lambda: self.client.aio.models.generate_content(
                 model=self.model,
                 contents=[
                     types.Part.from_bytes(data=image_bytes, mime_type=mime_type),
@@ -104,7 +623,7 @@ class FoodAI:
                     temperature=0.2,
                     max_output_tokens=256,
                 ),
-            )
+            ))
             raw = response.text or ""
             return _parse_ai_response(raw)
         except Exception as e:
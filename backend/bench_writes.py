@@ -0,0 +1,61 @@
+"""
+bench_writes.py — Food-log insert throughput with and without group commit
+
+    python bench_writes.py [--threads 16] [--inserts 200] [--window-ms 0] [--synchronous NORMAL]
+
+Each run uses a fresh temporary database and the same number of concurrent
+writer threads (like the FastAPI threadpool at peak), first with
+DB_GROUP_COMMIT=0 (one transaction per insert), then with group commit.
+"""
+
+import argparse
+import os
+import tempfile
+import threading
+import time
+
+parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+parser.add_argument("--threads", type=int, default=16)
+parser.add_argument("--inserts", type=int, default=200, help="inserts per thread")
+parser.add_argument("--window-ms", type=float, default=0.0)
+parser.add_argument("--synchronous", default="NORMAL", help="NORMAL or FULL")
+args = parser.parse_args()
+
+# Must be set before database.py builds its connection PRAGMAs
+os.environ["DB_SYNCHRONOUS"] = args.synchronous
+
+import database  # noqa: E402
+
+
+def run(group_commit: bool, window_ms: float = 0.0) -> float:
+    database.close_all_connections()
+    database.DB_GROUP_COMMIT = group_commit
+    database.DB_GROUP_COMMIT_MS = window_ms
+    with tempfile.TemporaryDirectory() as tmp:
+        database.DB_PATH = os.path.join(tmp, "bench.db")
+        database.init_db()
+        for user_id in range(args.threads):
+            database.upsert_user(user_id)
+
+        def worker(user_id: int) -> None:
+            for i in range(args.inserts):
+                database.add_food_log(user_id, f"Продукт {i}", 100, 10.0, 10.0, 5.0)
+
+        threads = [threading.Thread(target=worker, args=(u,)) for u in range(args.threads)]
+        start = time.perf_counter()
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        elapsed = time.perf_counter() - start
+        database.close_all_connections()
+
+    return args.threads * args.inserts / elapsed
+
+
+if __name__ == "__main__":
+    print(f"{args.threads} threads × {args.inserts} inserts, synchronous={args.synchronous}")
+    baseline = run(False)
+    print(f"   one commit per insert:      {baseline:8.0f} inserts/sec")
+    grouped = run(True, args.window_ms)
+    print(f"   group commit (+{args.window_ms:g} ms window): {grouped:8.0f} inserts/sec  ({grouped / baseline:.1f}x)")
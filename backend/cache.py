@@ -0,0 +1,256 @@
+"""
+cache.py — Bounded TTL + LRU caches: a keyed cache with an optional SQLite
+persistent tier, and a near-duplicate cache for photos
+"""
+
+import asyncio
+import json
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from pathlib import Path
+from typing import Any
+
+# Returned by TTLCache.get() when the key is absent, so that None can be cached.
+MISS = object()
+
+
+class TTLCache:
+    """
+    In-process LRU cache whose entries expire after `ttl` seconds.
+
+    - `set_negative()` remembers a "not found" answer (stored as None) for
+      `negative_ttl` seconds, so repeated misses don't hit the upstream.
+    - With `persist_path`, entries are written through to a SQLite table and
+      read back on an in-memory miss, so the cache survives restarts.
+      Values must then be JSON-serializable. The table holds at most
+      `persist_maxsize` rows of this namespace once `prune()` has run.
+    - From async code use `aget()` / `aset()` / `aset_negative()`: memory hits
+      are answered inline and disk I/O runs in a worker thread.
+    """
+
+    def __init__(
+        self,
+        namespace: str,
+        *,
+        maxsize: int = 1024,
+        ttl: float = 3600,
+        negative_ttl: float | None = None,
+        persist_path: str | Path | None = None,
+        persist_maxsize: int = 100_000,
+    ):
+        self.namespace = namespace
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.negative_ttl = ttl if negative_ttl is None else negative_ttl
+        self.persist_maxsize = persist_maxsize
+        self._data: OrderedDict[str, tuple[float, Any]] = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+        self._db = None
+        self._db_lock = threading.Lock()
+        if persist_path:
+            self._db = sqlite3.connect(persist_path, check_same_thread=False, isolation_level=None)
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute("""
+                CREATE TABLE IF NOT EXISTS cache (
+                    namespace   TEXT NOT NULL,
+                    key         TEXT NOT NULL,
+                    value       TEXT,
+                    expires_at  REAL NOT NULL,
+                    PRIMARY KEY (namespace, key)
+                )
+            """)
+            self._db.execute("CREATE INDEX IF NOT EXISTS idx_cache_expires ON cache (namespace, expires_at)")
+            self.prune()
+
+    def get(self, key: str) -> Any:
+        """Return the cached value (possibly None for a negative entry) or MISS."""
+        value = self._get_memory(key)
+        if value is MISS and self._db is not None:
+            value = self._get_disk(key)
+        return self._count(value)
+
+    async def aget(self, key: str) -> Any:
+        """get() that reads the disk tier in a worker thread."""
+        value = self._get_memory(key)
+        if value is MISS and self._db is not None:
+            value = await asyncio.to_thread(self._get_disk, key)
+        return self._count(value)
+
+    def set(self, key: str, value: Any, ttl: float | None = None) -> None:
+        expires_at = self._set_memory(key, value, ttl)
+        if self._db is not None:
+            self._set_disk(key, value, expires_at)
+
+    async def aset(self, key: str, value: Any, ttl: float | None = None) -> None:
+        """set() that writes the disk tier in a worker thread."""
+        expires_at = self._set_memory(key, value, ttl)
+        if self._db is not None:
+            await asyncio.to_thread(self._set_disk, key, value, expires_at)
+
+    def set_negative(self, key: str) -> None:
+        self.set(key, None, ttl=self.negative_ttl)
+
+    async def aset_negative(self, key: str) -> None:
+        await self.aset(key, None, ttl=self.negative_ttl)
+
+    def prune(self) -> int:
+        """
+        Delete expired rows of this namespace from the disk tier, then the
+        soonest-expiring ones above `persist_maxsize`. Returns rows deleted.
+        """
+        if self._db is None:
+            return 0
+        with self._db_lock:
+            deleted = self._db.execute(
+                "DELETE FROM cache WHERE namespace = ? AND expires_at < ?",
+                (self.namespace, time.time()),
+            ).rowcount
+            (count,) = self._db.execute(
+                "SELECT COUNT(*) FROM cache WHERE namespace = ?", (self.namespace,)
+            ).fetchone()
+            if count > self.persist_maxsize:
+                deleted += self._db.execute("""
+                    DELETE FROM cache WHERE namespace = ?1 AND key IN (
+                        SELECT key FROM cache WHERE namespace = ?1 ORDER BY expires_at LIMIT ?2
+                    )
+                """, (self.namespace, count - self.persist_maxsize)).rowcount
+        return deleted
+
+    def _get_memory(self, key: str) -> Any:
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                return MISS
+            if entry[0] < time.time():
+                del self._data[key]
+                return MISS
+            self._data.move_to_end(key)
+            return entry[1]
+
+    def _get_disk(self, key: str) -> Any:
+        with self._db_lock:
+            row = self._db.execute(
+                "SELECT value, expires_at FROM cache WHERE namespace = ? AND key = ?",
+                (self.namespace, key),
+            ).fetchone()
+        if not row or row[1] < time.time():
+            return MISS
+        value = json.loads(row[0])
+        with self._lock:
+            self._store(key, (row[1], value))
+        return value
+
+    def _set_memory(self, key: str, value: Any, ttl: float | None) -> float:
+        expires_at = time.time() + (self.ttl if ttl is None else ttl)
+        with self._lock:
+            self._store(key, (expires_at, value))
+        return expires_at
+
+    def _set_disk(self, key: str, value: Any, expires_at: float) -> None:
+        with self._db_lock:
+            self._db.execute(
+                "INSERT OR REPLACE INTO cache (namespace, key, value, expires_at) VALUES (?, ?, ?, ?)",
+                (self.namespace, key, json.dumps(value, ensure_ascii=False), expires_at),
+            )
+
+    def _count(self, value: Any) -> Any:
+        with self._lock:
+            if value is MISS:
+                self.misses += 1
+            else:
+                self.hits += 1
+        return value
+
+    def _store(self, key: str, entry: tuple[float, Any]) -> None:
+        self._data[key] = entry
+        self._data.move_to_end(key)
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+            self.evictions += 1
+
+    def stats(self) -> dict:
+        total = self.hits + self.misses
+        return {
+            "size": len(self._data),
+            "maxsize": self.maxsize,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_rate": round(self.hits / total, 3) if total else 0.0,
+        }
+
+
+class PhotoCache:
+    """
+    In-process LRU cache of photo analyses keyed by the SHA-256 of the upload
+    plus a 64-bit perceptual hash. `get()` returns an exact match, or else the
+    most recent entry whose perceptual hash is within `max_distance` bits.
+    None results ("no food") are cached for `negative_ttl` seconds.
+    """
+
+    def __init__(self, *, maxsize: int = 2000, ttl: float = 86400,
+                 negative_ttl: float | None = None, max_distance: int = 4):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.negative_ttl = ttl if negative_ttl is None else negative_ttl
+        self.max_distance = max_distance
+        # sha256 -> (expires_at, perceptual hash or None, value)
+        self._data: OrderedDict[str, tuple[float, int | None, Any]] = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.near_hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, digest: str, phash: int | None = None) -> Any:
+        """Return the cached value for this photo or a near-duplicate, or MISS."""
+        now = time.time()
+        with self._lock:
+            key = digest
+            entry = self._data.get(digest)
+            if entry is not None and entry[0] < now:
+                del self._data[digest]
+                entry = None
+
+            if entry is None and phash is not None:
+                # Newest entries first, so a re-sent photo finds the latest answer
+                for candidate, cand_entry in reversed(self._data.items()):
+                    if (cand_entry[1] is not None and cand_entry[0] >= now
+                            and (cand_entry[1] ^ phash).bit_count() <= self.max_distance):
+                        key, entry = candidate, cand_entry
+                        self.near_hits += 1
+                        break
+
+            if entry is None:
+                self.misses += 1
+                return MISS
+            self._data.move_to_end(key)
+            self.hits += 1
+            return entry[2]
+
+    def set(self, digest: str, phash: int | None, value: Any) -> None:
+        ttl = self.ttl if value is not None else self.negative_ttl
+        with self._lock:
+            self._data[digest] = (time.time() + ttl, phash, value)
+            self._data.move_to_end(digest)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+                self.evictions += 1
+
+    def stats(self) -> dict:
+        total = self.hits + self.misses
+        return {
+            "size": len(self._data),
+            "maxsize": self.maxsize,
+            "hits": self.hits,
+            "near_hits": self.near_hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_rate": round(self.hits / total, 3) if total else 0.0,
+        }
@@ -0,0 +1,155 @@
+"""
+catalog.py — Compact columnar food catalog (local_db.bin) shared via mmap
+
+Layout: MAGIC, a little-endian uint32 header length, a JSON header, then
+8-byte aligned sections described by the header:
+    name_offsets  uint32[count + 1]   — byte offsets into `names`
+    names         utf-8 blob          — all food names back to back
+    calories      int32[count]
+    protein/carbs/fat float32[count]
+    category/brand  uint16[count]     — codes into the header's string tables
+"""
+
+import json
+import mmap
+import os
+import struct
+import tempfile
+from collections.abc import Sequence
+from pathlib import Path
+
+import numpy as np
+
+MAGIC = b"FCAT\x01\n"
+_ALIGN = 8
+
+def _encode(items: list[dict]) -> bytes:
+    categories: dict[str, int] = {}
+    brands: dict[str, int] = {}
+    names = [item["food_name"].encode("utf-8") for item in items]
+
+    sections = {
+        "name_offsets": np.cumsum([0] + [len(n) for n in names], dtype=np.uint32),
+        "names": np.frombuffer(b"".join(names), dtype=np.uint8),
+        "calories": np.array([item["calories"] for item in items], dtype=np.int32),
+        "protein": np.array([item["protein"] or 0 for item in items], dtype=np.float32),
+        "carbs": np.array([item["carbs"] or 0 for item in items], dtype=np.float32),
+        "fat": np.array([item["fat"] or 0 for item in items], dtype=np.float32),
+        "category": np.array(
+            [categories.setdefault(item.get("category", ""), len(categories)) for item in items],
+            dtype=np.uint16,
+        ),
+        "brand": np.array(
+            [brands.setdefault(item.get("brand", ""), len(brands)) for item in items],
+            dtype=np.uint16,
+        ),
+    }
+
+    layout = {}
+    body = bytearray()
+    for name, arr in sections.items():
+        body += b"\0" * (-len(body) % _ALIGN)
+        layout[name] = [len(body), arr.dtype.str, arr.size]
+        body += arr.tobytes()
+
+    header = json.dumps({
+        "count": len(items),
+        "sections": layout,
+        "categories": list(categories),
+        "brands": list(brands),
+    }, ensure_ascii=False).encode("utf-8")
+    prefix = MAGIC + struct.pack("<I", len(header)) + header
+    prefix += b"\0" * (-len(prefix) % _ALIGN)
+    return prefix + bytes(body)
+
+
+def write_catalog(items: list[dict], path: str | os.PathLike) -> None:
+    """Write items to `path` atomically so concurrent readers never see a partial file."""
+    path = Path(path)
+    fd, tmp_path = tempfile.mkstemp(dir=path.parent, prefix=path.name, suffix=".tmp")
+    try:
+        os.fchmod(fd, 0o644)
+        with os.fdopen(fd, "wb") as f:
+            f.write(_encode(items))
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
+
+
+class Catalog(Sequence):
+    """
+    Read-only view over an encoded catalog. Columns are numpy views straight
+    into the buffer, so an mmap-backed catalog is shared between processes.
+    Items are materialized as dicts only when indexed.
+    """
+
+    def __init__(self, buf):
+        if bytes(buf[:len(MAGIC)]) != MAGIC:
+            raise ValueError("Not a food catalog file")
+        (header_len,) = struct.unpack_from("<I", buf, len(MAGIC))
+        start = len(MAGIC) + 4
+        header = json.loads(bytes(buf[start:start + header_len]))
+        base = start + header_len + (-(start + header_len) % _ALIGN)
+
+        self._buf = buf
+        self._count = header["count"]
+        self._categories = header["categories"]
+        self._brands = header["brands"]
+        cols = {
+            name: np.frombuffer(buf, dtype=np.dtype(dtype), count=size, offset=base + offset)
+            for name, (offset, dtype, size) in header["sections"].items()
+        }
+        self._offsets = cols.pop("name_offsets")
+        self._names = cols.pop("names")
+        self._cols = cols
+
+    @classmethod
+    def open(cls, path: str | os.PathLike) -> "Catalog":
+        with open(path, "rb") as f:
+            return cls(mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ))
+
+    @classmethod
+    def from_items(cls, items: list[dict]) -> "Catalog":
+        return cls(_encode(items))
+
+    def __len__(self) -> int:
+        return self._count
+
+    def __getitem__(self, i: int) -> dict:
+        if not -self._count <= i < self._count:
+            raise IndexError(i)
+        i %= self._count
+        cols = self._cols
+        return {
+            "food_name": self.food_name(i),
+            "calories": int(cols["calories"][i]),
+            "protein": round(float(cols["protein"][i]), 2),
+            "carbs": round(float(cols["carbs"][i]), 2),
+            "fat": round(float(cols["fat"][i]), 2),
+            "category": self._categories[cols["category"][i]],
+            "brand": self._brands[cols["brand"][i]],
+        }
+
+    def food_name(self, i: int) -> str:
+        return self._names[self._offsets[i]:self._offsets[i + 1]].tobytes().decode("utf-8")
+
+    def food_names(self) -> list[str]:
+        blob = self._names.tobytes()
+        offsets = self._offsets.tolist()
+        return [blob[a:b].decode("utf-8") for a, b in zip(offsets, offsets[1:])]
+
+
+def load_catalog(json_path: str | os.PathLike, bin_path: str | os.PathLike) -> Catalog | None:
+    """
+    Memory-map `bin_path`, (re)building it from `json_path` first when it is
+    missing or older than the JSON source. Returns None if neither file exists.
+    """
+    json_path, bin_path = Path(json_path), Path(bin_path)
+    if json_path.exists():
+        if not bin_path.exists() or bin_path.stat().st_mtime < json_path.stat().st_mtime:
+            with open(json_path, "r", encoding="utf-8") as f:
+                write_catalog(json.load(f), bin_path)
+    elif not bin_path.exists():
+        return None
+    return Catalog.open(bin_path)
@@ -3,31 +3,244 @@ database.py — SQLite database layer for Calorie Tracker API
 """
 
 from contextlib import contextmanager
+import asyncio
+import logging
+import os
+import queue
 import sqlite3
-from datetime import date
+import threading
+import time
+import weakref
+from collections.abc import Callable, Iterable
+from concurrent.futures import Future, ThreadPoolExecutor
+from datetime import date, timedelta
+from functools import partial
+from itertools import groupby, islice
 from pathlib import Path
+from typing import Any, NamedTuple, TypeVar
+
+logger = logging.getLogger(__name__)
 
 DB_PATH = Path(__file__).parent / "calorie_tracker.db"
 
+# Tunables (see .env.example). WAL lets /api/stats readers run while the
+# threadpool writes; NORMAL sync is durable across app crashes in WAL mode.
+DB_JOURNAL_MODE = os.getenv("DB_JOURNAL_MODE", "WAL")
+DB_SYNCHRONOUS = os.getenv("DB_SYNCHRONOUS", "NORMAL")
+DB_BUSY_TIMEOUT_MS = int(os.getenv("DB_BUSY_TIMEOUT_MS", "5000"))
+DB_CACHE_SIZE_KB = int(os.getenv("DB_CACHE_SIZE_KB", "8000"))
+DB_MMAP_SIZE = int(os.getenv("DB_MMAP_SIZE", str(128 * 1024 * 1024)))
+DB_CHECKPOINT_SECONDS = float(os.getenv("DB_CHECKPOINT_SECONDS", "300"))
+DB_THREADS = int(os.getenv("DB_THREADS", "4"))
+# Group commit: food/water/weight inserts queued while the previous commit was
+# in flight share the next transaction. DB_GROUP_COMMIT_MS additionally holds
+# each batch open that long for late arrivals (the durability window).
+DB_GROUP_COMMIT = os.getenv("DB_GROUP_COMMIT", "1") == "1"
+DB_GROUP_COMMIT_MS = float(os.getenv("DB_GROUP_COMMIT_MS", "0"))
+DB_GROUP_COMMIT_MAX = int(os.getenv("DB_GROUP_COMMIT_MAX", "256"))
+
+# Applied once when a connection is opened. The page cache lives as long as
+# the connection, so it now survives between requests served by a thread.
+CONNECTION_PRAGMAS = (
+    f"PRAGMA busy_timeout = {DB_BUSY_TIMEOUT_MS}",
+    f"PRAGMA synchronous = {DB_SYNCHRONOUS}",
+    f"PRAGMA cache_size = -{DB_CACHE_SIZE_KB}",
+    f"PRAGMA mmap_size = {DB_MMAP_SIZE}",
+    "PRAGMA temp_store = MEMORY",
+)
+# Per-connection LRU of compiled statements (sqlite3 default is 128)
+CACHED_STATEMENTS = 256
+
+# One persistent connection per thread (FastAPI threadpool workers are reused).
+# Worker threads exit when idle; the connection is closed as soon as its
+# thread's locals are dropped (see _ThreadConnection). _all_conns is weak and
+# only serves close_all_connections().
+_local = threading.local()
+_all_conns: "weakref.WeakSet[sqlite3.Connection]" = weakref.WeakSet()
+_all_conns_lock = threading.Lock()
+_generation = 0   # bumped by close_all_connections() to invalidate thread-locals
+
+
+class _Connection(sqlite3.Connection):
+    """sqlite3.Connection itself can't be weakly referenced; a subclass can."""
+
+
+class _ThreadConnection:
+    """
+    Stored in the thread-local next to the connection. It is freed by
+    refcount when the thread exits and closes the connection then, instead
+    of leaving it to the cyclic GC.
+    """
+
+    def __init__(self, conn: sqlite3.Connection):
+        weakref.finalize(self, conn.close)
+
+
+def _connect() -> sqlite3.Connection:
+    conn = sqlite3.connect(DB_PATH, check_same_thread=False, cached_statements=CACHED_STATEMENTS,
+                           factory=_Connection)
+    conn.row_factory = sqlite3.Row
+    for pragma in CONNECTION_PRAGMAS:
+        conn.execute(pragma)
+    with _all_conns_lock:
+        _all_conns.add(conn)
+    return conn
+
 
 @contextmanager
 def get_conn():
-    conn = sqlite3.connect(DB_PATH, check_same_thread=False)
-    conn.row_factory = sqlite3.Row
+    """
+    Yield this thread's connection, opening it on first use.
+    The outermost `with get_conn()` commits or rolls back; nested blocks
+    join the enclosing transaction.
+    """
+    conn = getattr(_local, "conn", None)
+    if conn is None or _local.key != (DB_PATH, _generation):
+        conn = _local.conn = _connect()
+        _local.owner = _ThreadConnection(conn)
+        _local.key = (DB_PATH, _generation)
+        _local.depth = 0
+
+    _local.depth += 1
     try:
         yield conn
-        conn.commit()
+        if _local.depth == 1:
+            conn.commit()
     except Exception:
-        conn.rollback()
+        if _local.depth == 1:
+            conn.rollback()
         raise
     finally:
-        conn.close()
+        _local.depth -= 1
+
+
+# Dedicated threads (each with its own connection) for DB calls made from
+# async endpoints, so SQLite I/O never runs on the event loop and doesn't
+# compete with the default executor used for other blocking work.
+_executor = ThreadPoolExecutor(max_workers=DB_THREADS, thread_name_prefix="sqlite")
+
+
+async def run_db(fn: Callable[..., Any], /, *args, **kwargs) -> Any:
+    """Await any helper from this module without blocking the event loop."""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_executor, partial(fn, *args, **kwargs))
+
+
+def checkpoint_db(mode: str = "PASSIVE") -> None:
+    """Fold the WAL back into the database file so it doesn't grow unbounded."""
+    with get_conn() as conn:
+        busy, log_pages, done_pages = conn.execute(f"PRAGMA wal_checkpoint({mode})").fetchone()
+    if log_pages > 0:
+        logger.info("WAL checkpoint (%s): %d/%d pages, busy=%d", mode, done_pages, log_pages, busy)
+
+
+T = TypeVar("T")
+
+
+class _GroupCommitWriter:
+    """
+    A single writer thread. Everything queued by the time it picks up work
+    (plus whatever arrives within DB_GROUP_COMMIT_MS) runs in one transaction,
+    each job inside its own SAVEPOINT so a failing job only rolls back itself.
+    Callers get their result only after the shared commit.
+    """
+
+    def __init__(self):
+        self._queue: queue.SimpleQueue = queue.SimpleQueue()
+        self._thread: threading.Thread | None = None
+        self._lock = threading.Lock()
+
+    def submit(self, job: Callable[[sqlite3.Connection], T]) -> "Future[T]":
+        future: Future = Future()
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="sqlite-writer", daemon=True)
+                self._thread.start()
+            self._queue.put((job, future))
+        return future
+
+    def stop(self) -> None:
+        with self._lock:
+            if self._thread is not None:
+                self._queue.put(None)
+                self._thread.join()
+                self._thread = None
+
+    def _run(self) -> None:
+        conn = _connect()
+        while True:
+            item = self._queue.get()
+            if item is None:
+                return
+            batch = [item]
+            deadline = time.monotonic() + DB_GROUP_COMMIT_MS / 1000
+            while len(batch) < DB_GROUP_COMMIT_MAX:
+                try:
+                    remaining = deadline - time.monotonic()
+                    item = self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait()
+                except queue.Empty:
+                    break
+                if item is None:
+                    self._commit(conn, batch)
+                    return
+                batch.append(item)
+            self._commit(conn, batch)
+
+    @staticmethod
+    def _commit(conn: sqlite3.Connection, batch: list) -> None:
+        outcomes = []
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            for job, future in batch:
+                conn.execute("SAVEPOINT job")
+                try:
+                    outcomes.append((future, job(conn), None))
+                except Exception as e:
+                    conn.execute("ROLLBACK TO job")
+                    outcomes.append((future, None, e))
+                conn.execute("RELEASE job")
+            conn.commit()
+        except Exception as e:
+            conn.rollback()
+            for _, future in batch:
+                future.set_exception(e)
+            return
+
+        for future, result, error in outcomes:
+            if error is None:
+                future.set_result(result)
+            else:
+                future.set_exception(error)
+
+
+_writer = _GroupCommitWriter()
+
+
+def _write(job: Callable[[sqlite3.Connection], T]) -> T:
+    """Run a write job through the group-commit writer, or directly if disabled or nested."""
+    if DB_GROUP_COMMIT and getattr(_local, "depth", 0) == 0:
+        return _writer.submit(job).result()
+    with get_conn() as conn:
+        return job(conn)
+
+
+def close_all_connections() -> None:
+    """Close every thread's connection (call on shutdown)."""
+    global _generation
+    _writer.stop()
+    with _all_conns_lock:
+        _generation += 1
+        for conn in list(_all_conns):
+            conn.close()
+        _all_conns.clear()
 
 
 # ─────────────────────────── Schema ───────────────────────────
 
 def init_db() -> None:
     with get_conn() as conn:
+        # journal_mode is persistent in the database file, so once is enough
+        conn.execute(f"PRAGMA journal_mode = {DB_JOURNAL_MODE}")
         conn.executescript("""
             CREATE TABLE IF NOT EXISTS users (
                 id              INTEGER PRIMARY KEY,   -- Telegram user_id
@@ -109,22 +322,27 @@ def init_db() -> None:
                 FOREIGN KEY (user_id) REFERENCES users(id),
                 UNIQUE(user_id, food_name)
             );
+
+            CREATE TABLE IF NOT EXISTS barcodes (
+                barcode     TEXT PRIMARY KEY,
+                food_name   TEXT NOT NULL,
+                calories    INTEGER NOT NULL,
+                protein     REAL DEFAULT 0,
+                carbs       REAL DEFAULT 0,
+                fat         REAL DEFAULT 0,
+                brand       TEXT DEFAULT '',
+                image_url   TEXT DEFAULT '',
+                updated_at  TEXT DEFAULT (datetime('now'))   -- UTC, last OFF resolution
+            );
         """)
 
-        # ── Migrations (safe ALTER TABLE) ──────────────────────────────
-        _safe_add_column(conn, "users", "protein_goal", "REAL DEFAULT 120")
-        _safe_add_column(conn, "users", "carbs_goal",   "REAL DEFAULT 200")
-        _safe_add_column(conn, "users", "fat_goal",     "REAL DEFAULT 55")
-        _safe_add_column(conn, "users", "goal_type",    "TEXT DEFAULT 'maintain'")
-        _safe_add_column(conn, "users", "activity_level","TEXT DEFAULT 'light'")
-        _safe_add_column(conn, "users", "water_goal",   "INTEGER DEFAULT 2000")
-        _safe_add_column(conn, "users", "setup_complete","INTEGER DEFAULT 0")
-        _safe_add_column(conn, "users", "gender",       "TEXT DEFAULT 'male'")
-        _safe_add_column(conn, "users", "activity",     "REAL DEFAULT 1.375")
-        _safe_add_column(conn, "users", "current_streak","INTEGER DEFAULT 0")
-        _safe_add_column(conn, "users", "last_active_date","TEXT")
-        _safe_add_column(conn, "food_logs", "meal_type", "TEXT DEFAULT 'any'")
+        _migrate(conn)
+
 
+# ─────────────────────────── Migrations ───────────────────────────
+# Each migration runs once, in order, in its own transaction. The number of
+# applied migrations is stored in PRAGMA user_version. Append new steps to
+# MIGRATIONS; never edit or reorder the ones already shipped.
 
 def _safe_add_column(conn, table: str, column: str, col_def: str) -> None:
     try:
@@ -133,6 +351,153 @@ def _safe_add_column(conn, table: str, column: str, col_def: str) -> None:
         pass  # Column already exists
 
 
+def _m001_legacy_columns(conn) -> None:
+    """Columns added before migrations were versioned; any subset may exist."""
+    _safe_add_column(conn, "users", "protein_goal", "REAL DEFAULT 120")
+    _safe_add_column(conn, "users", "carbs_goal",   "REAL DEFAULT 200")
+    _safe_add_column(conn, "users", "fat_goal",     "REAL DEFAULT 55")
+    _safe_add_column(conn, "users", "goal_type",    "TEXT DEFAULT 'maintain'")
+    _safe_add_column(conn, "users", "activity_level","TEXT DEFAULT 'light'")
+    _safe_add_column(conn, "users", "water_goal",   "INTEGER DEFAULT 2000")
+    _safe_add_column(conn, "users", "setup_complete","INTEGER DEFAULT 0")
+    _safe_add_column(conn, "users", "gender",       "TEXT DEFAULT 'male'")
+    _safe_add_column(conn, "users", "activity",     "REAL DEFAULT 1.375")
+    _safe_add_column(conn, "users", "current_streak","INTEGER DEFAULT 0")
+    _safe_add_column(conn, "users", "last_active_date","TEXT")
+    _safe_add_column(conn, "food_logs", "meal_type", "TEXT DEFAULT 'any'")
+
+
+def _m002_per_user_indexes(conn) -> None:
+    """Per-user lookups ordered the way the queries read them."""
+    conn.execute("""
+        CREATE INDEX IF NOT EXISTS idx_food_logs_user_date
+        ON food_logs (user_id, date, logged_at)
+    """)  # get_logs_by_date, get_logs_by_date_range, get_today_logs
+    conn.execute("""
+        CREATE INDEX IF NOT EXISTS idx_food_logs_user_food
+        ON food_logs (user_id, food_name, logged_at)
+    """)  # get_recent_foods
+    conn.execute("""
+        CREATE INDEX IF NOT EXISTS idx_water_logs_user_date
+        ON water_logs (user_id, date, logged_at, amount_ml)
+    """)  # get_water_by_date
+    conn.execute("""
+        CREATE INDEX IF NOT EXISTS idx_weight_history_user_date
+        ON weight_history (user_id, date, weight)
+    """)  # get_weight_history, add_weight_history
+
+
+def _m003_daily_totals(conn) -> None:
+    """
+    Per-user, per-day aggregates kept in sync by triggers, so every write path
+    (single inserts, executemany, deletes) updates them in the same transaction.
+    """
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS daily_totals (
+            user_id     INTEGER NOT NULL,
+            date        TEXT    NOT NULL,
+            calories    INTEGER NOT NULL DEFAULT 0,
+            protein     REAL    NOT NULL DEFAULT 0,
+            carbs       REAL    NOT NULL DEFAULT 0,
+            fat         REAL    NOT NULL DEFAULT 0,
+            water_ml    INTEGER NOT NULL DEFAULT 0,
+            entry_count INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (user_id, date)
+        ) WITHOUT ROWID
+    """)
+
+    conn.execute("""
+        CREATE TRIGGER IF NOT EXISTS trg_food_logs_insert AFTER INSERT ON food_logs BEGIN
+            INSERT INTO daily_totals (user_id, date, calories, protein, carbs, fat, entry_count)
+            VALUES (NEW.user_id, NEW.date, NEW.calories,
+                    COALESCE(NEW.protein, 0), COALESCE(NEW.carbs, 0), COALESCE(NEW.fat, 0), 1)
+            ON CONFLICT (user_id, date) DO UPDATE SET
+                calories    = calories + excluded.calories,
+                protein     = protein + excluded.protein,
+                carbs       = carbs + excluded.carbs,
+                fat         = fat + excluded.fat,
+                entry_count = entry_count + 1;
+        END
+    """)
+    conn.execute("""
+        CREATE TRIGGER IF NOT EXISTS trg_food_logs_delete AFTER DELETE ON food_logs BEGIN
+            UPDATE daily_totals SET
+                calories    = calories - OLD.calories,
+                protein     = protein - COALESCE(OLD.protein, 0),
+                carbs       = carbs - COALESCE(OLD.carbs, 0),
+                fat         = fat - COALESCE(OLD.fat, 0),
+                entry_count = entry_count - 1
+            WHERE user_id = OLD.user_id AND date = OLD.date;
+        END
+    """)
+    conn.execute("""
+        CREATE TRIGGER IF NOT EXISTS trg_water_logs_insert AFTER INSERT ON water_logs BEGIN
+            INSERT INTO daily_totals (user_id, date, water_ml)
+            VALUES (NEW.user_id, NEW.date, NEW.amount_ml)
+            ON CONFLICT (user_id, date) DO UPDATE SET water_ml = water_ml + excluded.water_ml;
+        END
+    """)
+    conn.execute("""
+        CREATE TRIGGER IF NOT EXISTS trg_water_logs_delete AFTER DELETE ON water_logs BEGIN
+            UPDATE daily_totals SET water_ml = water_ml - OLD.amount_ml
+            WHERE user_id = OLD.user_id AND date = OLD.date;
+        END
+    """)
+
+    # Backfill from existing history
+    conn.execute("""
+        INSERT INTO daily_totals (user_id, date, calories, protein, carbs, fat, water_ml, entry_count)
+        SELECT user_id, date, SUM(calories), SUM(protein), SUM(carbs), SUM(fat), SUM(water_ml), SUM(entry_count)
+        FROM (
+            SELECT user_id, date, calories, COALESCE(protein, 0) AS protein, COALESCE(carbs, 0) AS carbs,
+                   COALESCE(fat, 0) AS fat, 0 AS water_ml, 1 AS entry_count
+            FROM food_logs
+            UNION ALL
+            SELECT user_id, date, 0, 0, 0, 0, amount_ml, 0
+            FROM water_logs
+        )
+        WHERE user_id IS NOT NULL AND date IS NOT NULL
+        GROUP BY user_id, date
+        ON CONFLICT (user_id, date) DO UPDATE SET
+            calories    = excluded.calories,
+            protein     = excluded.protein,
+            carbs       = excluded.carbs,
+            fat         = excluded.fat,
+            water_ml    = excluded.water_ml,
+            entry_count = excluded.entry_count
+    """)
+
+
+MIGRATIONS = [
+    _m001_legacy_columns,
+    _m002_per_user_indexes,
+    _m003_daily_totals,
+]
+
+
+def _migrate(conn) -> None:
+    """
+    Apply pending migrations one transaction each. The version is read after
+    BEGIN IMMEDIATE, so workers starting at the same time can't both apply
+    the same migration.
+    """
+    while True:
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            version = conn.execute("PRAGMA user_version").fetchone()[0]
+            if version >= len(MIGRATIONS):
+                conn.commit()
+                return
+            migration = MIGRATIONS[version]
+            migration(conn)
+            conn.execute(f"PRAGMA user_version = {version + 1}")
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        logger.info("Applied migration %d: %s", version + 1, migration.__name__)
+
+
 # ─────────────────────────── TDEE / Goals Calculator ──────────────────
 
 ACTIVITY_MULTIPLIERS = {
@@ -357,8 +722,9 @@ def add_food_log(
     meal_type: str = 'any',
     log_date: str | None = None
 ) -> int:
-    with get_conn() as conn:
-        actual_date = log_date or date.today().isoformat()
+    actual_date = log_date or date.today().isoformat()
+
+    def insert(conn) -> int:
         cur = conn.execute(
             """
             INSERT INTO food_logs (user_id, food_name, calories, protein, carbs, fat, emoji, source, meal_type, date)
@@ -366,8 +732,42 @@ def add_food_log(
             """,
             (user_id, food_name, calories, protein, carbs, fat, emoji, source, meal_type, actual_date)
         )
+        if actual_date == date.today().isoformat():
+            _touch_streak(conn, user_id)
         return cur.lastrowid
 
+    return _write(insert)
+
+
+def add_food_logs(user_id: int, items: list[dict], source: str = 'manual') -> list[int]:
+    """
+    Insert several food logs (keys as in add_food_log) with one executemany
+    in one transaction. Returns the new ids in input order.
+    """
+    today = date.today().isoformat()
+    rows = [
+        (user_id, item["food_name"], item["calories"], item.get("protein"), item.get("carbs"),
+         item.get("fat"), item.get("emoji"), source, item.get("meal_type", "any"),
+         item.get("log_date") or today)
+        for item in items
+    ]
+
+    def insert(conn) -> list[int]:
+        conn.executemany(
+            """
+            INSERT INTO food_logs (user_id, food_name, calories, protein, carbs, fat, emoji, source, meal_type, date)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+            """,
+            rows
+        )
+        # The transaction holds the write lock, so AUTOINCREMENT ids are consecutive
+        last_id = conn.execute("SELECT last_insert_rowid()").fetchone()[0]
+        if any(row[-1] == today for row in rows):
+            _touch_streak(conn, user_id)
+        return list(range(last_id - len(rows) + 1, last_id + 1))
+
+    return _write(insert)
+
 
 def delete_food_log(log_id: int, user_id: int) -> bool:
     with get_conn() as conn:
@@ -420,17 +820,69 @@ def get_recent_foods(user_id: int, limit: int = 20) -> list[sqlite3.Row]:
         """, (user_id, limit)).fetchall()
 
 
+def get_daily_totals_range(user_id: int, start_date: str, end_date: str) -> list[sqlite3.Row]:
+    with get_conn() as conn:
+        return conn.execute("""
+            SELECT date, calories, protein, carbs, fat, water_ml, entry_count
+            FROM daily_totals
+            WHERE user_id = ? AND date >= ? AND date <= ?
+            ORDER BY date
+        """, (user_id, start_date, end_date)).fetchall()
+
+
+class DaySnapshot(NamedTuple):
+    user: sqlite3.Row
+    logs: list[sqlite3.Row]
+    water: list[sqlite3.Row]
+    totals: sqlite3.Row | None
+    streak: int
+
+
+def get_day_snapshot(user_id: int, target_date: str) -> DaySnapshot | None:
+    """
+    Everything /api/stats needs for one day — user row, food logs, water logs,
+    daily totals and streak — read in a single read-only transaction on one
+    connection. Returns None if the user doesn't exist.
+    """
+    with get_conn() as conn:
+        if not conn.in_transaction:
+            conn.execute("BEGIN")
+        user = conn.execute("SELECT * FROM users WHERE id = ?", (user_id,)).fetchone()
+        if not user:
+            return None
+        logs = conn.execute("""
+            SELECT id, food_name, calories, protein, carbs, fat, emoji, source, meal_type, logged_at
+            FROM food_logs
+            WHERE user_id = ? AND date = ?
+            ORDER BY logged_at DESC
+        """, (user_id, target_date)).fetchall()
+        water = conn.execute("""
+            SELECT id, amount_ml, logged_at FROM water_logs
+            WHERE user_id = ? AND date = ?
+            ORDER BY logged_at DESC
+        """, (user_id, target_date)).fetchall()
+        totals = conn.execute("""
+            SELECT date, calories, protein, carbs, fat, water_ml, entry_count
+            FROM daily_totals
+            WHERE user_id = ? AND date = ?
+        """, (user_id, target_date)).fetchone()
+        return DaySnapshot(user, logs, water, totals, effective_streak(user))
+
+
 # ─────────────────────────── Water & Weight ───────────────────────────
 
 def add_water(user_id: int, amount_ml: int) -> int:
     today = date.today().isoformat()
-    with get_conn() as conn:
+
+    def insert(conn) -> int:
         cur = conn.execute("""
             INSERT INTO water_logs (user_id, amount_ml, date)
             VALUES (?, ?, ?)
         """, (user_id, amount_ml, today))
         return cur.lastrowid
 
+    return _write(insert)
+
 
 def delete_water(log_id: int, user_id: int) -> bool:
     with get_conn() as conn:
@@ -449,7 +901,8 @@ def get_water_by_date(user_id: int, target_date: str) -> list[sqlite3.Row]:
 
 def add_weight_history(user_id: int, weight: float) -> None:
     today = date.today().isoformat()
-    with get_conn() as conn:
+
+    def upsert(conn) -> None:
         existing = conn.execute(
             "SELECT id FROM weight_history WHERE user_id = ? AND date = ?",
             (user_id, today)
@@ -462,6 +915,8 @@ def add_weight_history(user_id: int, weight: float) -> None:
                 (user_id, weight, today)
             )
 
+    _write(upsert)
+
 
 def get_weight_history(user_id: int, limit: int = 30) -> list[sqlite3.Row]:
     with get_conn() as conn:
@@ -472,38 +927,76 @@ def get_weight_history(user_id: int, limit: int = 30) -> list[sqlite3.Row]:
         """, (user_id, limit)).fetchall()
 
 
-def update_user_streak(user_id: int) -> int:
-    """Calculates and updates user streak based on consecutive days of food logs."""
-    today = date.today().isoformat()
-    with get_conn() as conn:
-        user = conn.execute(
-            "SELECT last_active_date, current_streak FROM users WHERE id = ?",
-            (user_id,)
-        ).fetchone()
-        if not user:
-            return 0
+def _next_streak(last_date: str | None, streak: int) -> int | None:
+    """New streak value for activity today, or None if today is already counted."""
+    today = date.today()
+    if last_date == today.isoformat():
+        return None
+    if last_date and date.fromisoformat(last_date) == today - timedelta(days=1):
+        return streak + 1
+    return 1
+
+
+def _touch_streak(conn, user_id: int) -> None:
+    """Count today as active for the user. Call inside the transaction that logs food."""
+    user = conn.execute(
+        "SELECT last_active_date, current_streak FROM users WHERE id = ?", (user_id,)
+    ).fetchone()
+    if not user:
+        return
+    new_streak = _next_streak(user["last_active_date"], user["current_streak"] or 0)
+    if new_streak is not None:
+        conn.execute(
+            "UPDATE users SET last_active_date = ?, current_streak = ? WHERE id = ?",
+            (date.today().isoformat(), new_streak, user_id)
+        )
 
-        last_date = user['last_active_date']
-        streak = user['current_streak'] or 0
 
-        if last_date == today:
-            return streak
+def effective_streak(user: sqlite3.Row) -> int:
+    """Streak as of today: it lapses once neither today nor yesterday has a food log."""
+    last_date = user["last_active_date"]
+    if not last_date or date.fromisoformat(last_date) < date.today() - timedelta(days=1):
+        return 0
+    return user["current_streak"] or 0
 
-        from datetime import datetime, timedelta
-        if last_date:
-            last_date_obj = datetime.fromisoformat(last_date).date()
-            if last_date_obj == date.today() - timedelta(days=1):
-                streak += 1
-            else:
-                streak = 1
-        else:
+
+def recompute_streaks() -> int:
+    """
+    Rebuild every user's streak from daily_totals (catches deleted logs and
+    back-dated entries). Returns the number of users whose streak changed.
+    """
+    today = date.today().isoformat()
+    with get_conn() as conn:
+        # Take the write lock before reading, so a commit landing between the
+        # SELECT and the UPDATEs can't invalidate the snapshot (SQLITE_BUSY_SNAPSHOT)
+        if not conn.in_transaction:
+            conn.execute("BEGIN IMMEDIATE")
+        days = conn.execute("""
+            SELECT user_id, date FROM daily_totals
+            WHERE entry_count > 0 AND date <= ?
+            ORDER BY user_id, date DESC
+        """, (today,)).fetchall()
+
+        updates = []
+        for user_id, rows in groupby(days, key=lambda r: r["user_id"]):
+            active = [date.fromisoformat(r["date"]) for r in rows]
             streak = 1
+            while streak < len(active) and active[streak - 1] - active[streak] == timedelta(days=1):
+                streak += 1
+            updates.append((active[0].isoformat(), streak, user_id))
 
-        conn.execute(
-            "UPDATE users SET last_active_date = ?, current_streak = ? WHERE id = ?",
-            (today, streak, user_id)
-        )
-        return streak
+        cur = conn.executemany("""
+            UPDATE users SET last_active_date = ?1, current_streak = ?2
+            WHERE id = ?3 AND (last_active_date IS NOT ?1 OR current_streak IS NOT ?2)
+        """, updates)
+        changed = cur.rowcount
+        cur = conn.execute("""
+            UPDATE users SET last_active_date = NULL, current_streak = 0
+            WHERE current_streak != 0 AND id NOT IN (
+                SELECT user_id FROM daily_totals WHERE entry_count > 0 AND date <= ?
+            )
+        """, (today,))
+        return changed + cur.rowcount
 
 
 def search_custom_foods(query: str, limit: int = 10) -> list[dict]:
@@ -518,3 +1011,46 @@ def search_custom_foods(query: str, limit: int = 10) -> list[dict]:
             (f"%{query}%", limit)
         ).fetchall()
         return [dict(row) for row in rows]
+
+
+# ─────────────────────────── Barcodes ───────────────────────────
+
+_UPSERT_BARCODE = """
+    INSERT INTO barcodes (barcode, food_name, calories, protein, carbs, fat, brand, image_url, updated_at)
+    VALUES (:barcode, :food_name, :calories, :protein, :carbs, :fat, :brand, :image_url, datetime('now'))
+    ON CONFLICT(barcode) DO UPDATE SET
+        food_name  = excluded.food_name,
+        calories   = excluded.calories,
+        protein    = excluded.protein,
+        carbs      = excluded.carbs,
+        fat        = excluded.fat,
+        brand      = excluded.brand,
+        image_url  = excluded.image_url,
+        updated_at = excluded.updated_at
+"""
+
+
+def get_barcode(barcode: str, stale_days: int = 30) -> sqlite3.Row | None:
+    """Returns the stored product plus a `stale` flag (older than stale_days)."""
+    with get_conn() as conn:
+        return conn.execute("""
+            SELECT *, updated_at < datetime('now', ?) AS stale
+            FROM barcodes WHERE barcode = ?
+        """, (f"-{stale_days} days", barcode)).fetchone()
+
+
+def upsert_barcode(product: dict) -> None:
+    """Store a resolved product (keys as returned by /api/barcode)."""
+    with get_conn() as conn:
+        conn.execute(_UPSERT_BARCODE, product)
+
+
+def import_barcodes(products: Iterable[dict], batch_size: int = 5000) -> int:
+    """Bulk-upsert products, one transaction per batch. Returns the number imported."""
+    products = iter(products)
+    total = 0
+    while batch := list(islice(products, batch_size)):
+        with get_conn() as conn:
+            conn.executemany(_UPSERT_BARCODE, batch)
+        total += len(batch)
+    return total
@@ -5,6 +5,8 @@ Includes: RU/BY branded products, sports nutrition, Asian cuisine, and more.
 
 import json
 
+from catalog import write_catalog
+
 # ─────────────────────────── Base Foods ───────────────────────────
 
 bases_meat = [
@@ -1058,6 +1060,9 @@ unique_db = {item["food_name"]: item for item in db}
 with open("local_db.json", "w", encoding="utf-8") as f:
     json.dump(list(unique_db.values()), f, ensure_ascii=False, indent=2)
 
+# Compact mmap-able copy loaded by the API at runtime
+write_catalog(list(unique_db.values()), "local_db.bin")
+
 print(f"Generated {len(unique_db)} unique food items.")
 by_cat = {}
 for item in unique_db.values():
@@ -0,0 +1,68 @@
+"""
+imaging.py — Image helpers for photo analysis
+"""
+
+import io
+from typing import NamedTuple
+
+from PIL import Image, ImageOps, UnidentifiedImageError
+
+# dHash grid: HASH_SIZE × HASH_SIZE bits, i.e. a 64-bit hash.
+HASH_SIZE = 8
+
+_FORMATS = {"jpeg": ("JPEG", "image/jpeg"), "webp": ("WEBP", "image/webp")}
+
+
+class PreparedPhoto(NamedTuple):
+    data: bytes
+    mime_type: str
+    phash: int
+
+
+def dhash(image_bytes: bytes) -> int | None:
+    """
+    Difference hash of an encoded image: shrink to a (HASH_SIZE+1)×HASH_SIZE
+    grayscale grid and set one bit per pixel that is brighter than its right
+    neighbour. Re-encoded, resized or slightly recropped copies of a photo
+    differ in only a few bits. Returns None for data Pillow can't decode.
+    """
+    try:
+        with Image.open(io.BytesIO(image_bytes)) as img:
+            img.draft("L", (HASH_SIZE * 8, HASH_SIZE * 8))  # cheap JPEG downscale while decoding
+            return _dhash(img)
+    except (UnidentifiedImageError, OSError, Image.DecompressionBombError):
+        return None
+
+
+def _dhash(img: Image.Image) -> int:
+    small = img.convert("L").resize((HASH_SIZE + 1, HASH_SIZE), Image.Resampling.LANCZOS)
+    pixels = small.tobytes()
+    value = 0
+    for row in range(HASH_SIZE):
+        offset = row * (HASH_SIZE + 1)
+        for col in range(HASH_SIZE):
+            value = (value << 1) | (pixels[offset + col] > pixels[offset + col + 1])
+    return value
+
+
+def prepare_photo(image_bytes: bytes, max_dim: int = 1024, fmt: str = "jpeg",
+                  quality: int = 85) -> PreparedPhoto | None:
+    """
+    Decode an upload once, apply its EXIF orientation, shrink it to fit
+    max_dim × max_dim and re-encode it as JPEG or WebP without any metadata.
+    Also returns the dHash of the result. None for data Pillow can't decode.
+    CPU-bound: meant to run in a worker process.
+    """
+    pil_format, mime_type = _FORMATS[fmt]
+    try:
+        with Image.open(io.BytesIO(image_bytes)) as img:
+            img.draft("RGB", (max_dim, max_dim))  # JPEG: decode at a reduced scale directly
+            img = ImageOps.exif_transpose(img)
+            img.thumbnail((max_dim, max_dim), Image.Resampling.LANCZOS)
+            img = img.convert("RGB")
+    except (UnidentifiedImageError, OSError, Image.DecompressionBombError):
+        return None
+
+    out = io.BytesIO()
+    img.save(out, pil_format, quality=quality, optimize=True)  # no exif= → metadata dropped
+    return PreparedPhoto(out.getvalue(), mime_type, _dhash(img))
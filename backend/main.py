@@ -2,12 +2,15 @@
 main.py — FastAPI backend for Calorie Tracker Telegram Mini App
 """
 
+import asyncio
+import json
 import logging
+import multiprocessing
 import os
+import threading
 import urllib.parse
-import json
 import httpx
-from rapidfuzz import fuzz
+from concurrent.futures import ProcessPoolExecutor
 from contextlib import asynccontextmanager
 from typing import Annotated
 from dotenv import load_dotenv
@@ -17,7 +20,7 @@ load_dotenv()
 from fastapi import FastAPI, File, Form, HTTPException, UploadFile, status
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.staticfiles import StaticFiles
-from fastapi.responses import FileResponse
+from fastapi.responses import FileResponse, JSONResponse, StreamingResponse
 
 from schemas import (
     AIFoodResult,
@@ -32,27 +35,37 @@ from schemas import (
     WaterAddRequest,
     WeightEntry,
     ManualFoodRequest,
+    BatchFoodRequest,
     WeeklyStatsResponse,
     CustomFoodRequest,
     FavoriteRequest,
     FavoriteResponse,
 )
 
-from ai import FoodAI
+from ai import AIUnavailable, FoodAI, GeminiScheduler
+from openfoodfacts import OFFUnavailable, fetch_barcode
+from cache import MISS, PhotoCache, TTLCache
+from catalog import load_catalog
+from imaging import prepare_photo
+from search import FoodIndex, parse_quantity
 from database import (
+    DB_CHECKPOINT_SECONDS,
+    run_db,
+    checkpoint_db,
+    close_all_connections,
     add_food_log,
+    add_food_logs,
     delete_food_log,
-    get_today_logs,
     get_user,
     init_db,
     upsert_user,
-    get_logs_by_date,
-    get_logs_by_date_range,
+    get_daily_totals_range,
+    get_day_snapshot,
     add_water,
     delete_water,
-    get_water_by_date,
     get_weight_history,
-    update_user_streak,
+    effective_streak,
+    recompute_streaks,
     add_custom_food,
     search_custom_foods,
     get_recent_foods,
@@ -61,6 +74,8 @@ from database import (
     remove_favorite,
     get_favorites,
     is_favorite,
+    get_barcode,
+    upsert_barcode,
 )
 
 # ─────────────────────────── Config ───────────────────────────
@@ -73,17 +88,167 @@ if not GEMINI_API_KEY:
     logger.warning("GEMINI_API_KEY is missing! Please set it in .env file.")
 GEMINI_MODEL = os.getenv("GEMINI_MODEL", "gemini-2.5-flash")
 
-food_ai = FoodAI(api_key=GEMINI_API_KEY, model=GEMINI_MODEL)
+# Gemini answers for /api/add-text. AI_CACHE_DB enables the persistent tier.
+ai_cache = TTLCache(
+    "gemini",
+    maxsize=int(os.getenv("AI_CACHE_SIZE", "10000")),
+    ttl=float(os.getenv("AI_CACHE_TTL", "2592000")),
+    negative_ttl=float(os.getenv("AI_CACHE_NEGATIVE_TTL", "86400")),
+    persist_path=os.getenv("AI_CACHE_DB") or None,
+    persist_maxsize=int(os.getenv("AI_CACHE_DB_SIZE", "100000")),
+)
+# Gemini answers for /api/analyze-photo, matched by content hash or perceptual hash.
+photo_cache = PhotoCache(
+    maxsize=int(os.getenv("PHOTO_CACHE_SIZE", "2000")),
+    ttl=float(os.getenv("PHOTO_CACHE_TTL", "86400")),
+    negative_ttl=float(os.getenv("PHOTO_CACHE_NEGATIVE_TTL", "3600")),
+    max_distance=int(os.getenv("PHOTO_CACHE_DISTANCE", "4")),
+)
+# Rate limit, concurrency, per-call timeout, retries on 429/503 and optional hedging for Gemini calls.
+gemini_scheduler = GeminiScheduler(
+    rate=float(os.getenv("GEMINI_RPS", "5")),
+    burst=int(os.getenv("GEMINI_BURST", "10")),
+    concurrency=int(os.getenv("GEMINI_CONCURRENCY", "8")),
+    timeout=float(os.getenv("GEMINI_TIMEOUT_SECONDS", "20")),
+    max_retries=int(os.getenv("GEMINI_MAX_RETRIES", "3")),
+    hedge=os.getenv("GEMINI_HEDGE", "0") == "1",
+)
+food_ai = FoodAI(
+    api_key=GEMINI_API_KEY,
+    model=GEMINI_MODEL,
+    cache=ai_cache,
+    photo_cache=photo_cache,
+    scheduler=gemini_scheduler,
+    batch_window_ms=float(os.getenv("GEMINI_BATCH_WINDOW_MS", "0")),
+    batch_size=int(os.getenv("GEMINI_BATCH_SIZE", "16")),
+)
 http_client = httpx.AsyncClient(timeout=8.0)
+# How long /api/search-food waits for OpenFoodFacts before returning local results only.
+OFF_SEARCH_BUDGET_MS = int(os.getenv("OFF_SEARCH_BUDGET_MS", "300"))
+
+# OpenFoodFacts search/barcode responses. OFF_CACHE_DB enables the persistent tier.
+off_cache = TTLCache(
+    "openfoodfacts",
+    maxsize=int(os.getenv("OFF_CACHE_SIZE", "5000")),
+    ttl=float(os.getenv("OFF_CACHE_TTL", "86400")),
+    negative_ttl=float(os.getenv("OFF_CACHE_NEGATIVE_TTL", "3600")),
+    persist_path=os.getenv("OFF_CACHE_DB") or None,
+    persist_maxsize=int(os.getenv("OFF_CACHE_DB_SIZE", "100000")),
+)
+# Uploads are downscaled and re-encoded before being sent to Gemini, in worker
+# processes (PHOTO_WORKERS=0 runs it in a thread instead).
+PHOTO_MAX_DIM = int(os.getenv("PHOTO_MAX_DIM", "1024"))
+PHOTO_FORMAT = os.getenv("PHOTO_FORMAT", "jpeg").lower()
+PHOTO_QUALITY = int(os.getenv("PHOTO_QUALITY", "85"))
+PHOTO_WORKERS = int(os.getenv("PHOTO_WORKERS", "1"))
+_photo_pool: ProcessPoolExecutor | None = None
+photo_stats = {"photos": 0, "bytes_in": 0, "bytes_out": 0}
+# Upload limit, and how many photos are read and analyzed at once; the rest wait in line.
+PHOTO_MAX_BYTES = 10 * 1024 * 1024
+UPLOAD_CHUNK_BYTES = 256 * 1024
+PHOTO_CONCURRENCY = int(os.getenv("PHOTO_CONCURRENCY", "4"))
+_photo_slots = asyncio.Semaphore(PHOTO_CONCURRENCY)
+photo_queue = {"waiting": 0, "active": 0, "max_waiting": 0, "rejected_too_large": 0}
+
+# Local barcode rows older than this are refreshed from OpenFoodFacts in the background.
+BARCODE_STALE_DAYS = int(os.getenv("BARCODE_STALE_DAYS", "30"))
+# Strong references to fire-and-forget tasks (the event loop only keeps weak ones).
+_background_tasks: set[asyncio.Task] = set()
+
+# ─────────────────────────── Local food catalog ───────────────────────────
+
+LOCAL_DB_JSON = os.path.join(os.path.dirname(__file__), "local_db.json")
+LOCAL_DB_BIN = os.path.join(os.path.dirname(__file__), "local_db.bin")
+# How often to check local_db.json / local_db.bin for changes (0 = never).
+LOCAL_DB_RELOAD_SECONDS = float(os.getenv("LOCAL_DB_RELOAD_SECONDS", "30"))
+# /api/add-text logs a catalog item without asking Gemini when the text has an
+# explicit weight/volume and the rest matches its name at least this well
+# (fuzz.ratio, 0-100; above 100 = never).
+LOCAL_MATCH_SCORE = float(os.getenv("LOCAL_MATCH_SCORE", "92"))
+
+# Current snapshot. Replaced as a whole on reload, never mutated in place,
+# so readers just grab the reference.
+LOCAL_DB_INDEX: FoodIndex | None = None
+_local_db_mtime: float | None = None
+_local_db_lock = threading.Lock()
+
+
+def _local_db_source_mtime() -> float | None:
+    mtimes = [os.path.getmtime(p) for p in (LOCAL_DB_JSON, LOCAL_DB_BIN) if os.path.exists(p)]
+    return max(mtimes) if mtimes else None
+
+
+def _load_local_db() -> None:
+    """Build the catalog and its search index, then swap the new snapshot in."""
+    global LOCAL_DB_INDEX, _local_db_mtime
+    with _local_db_lock:
+        catalog = load_catalog(LOCAL_DB_JSON, LOCAL_DB_BIN)
+        LOCAL_DB_INDEX = FoodIndex(catalog) if catalog is not None else None
+        # Read after loading: load_catalog may have just rebuilt the .bin
+        _local_db_mtime = _local_db_source_mtime()
+    logger.info("Local food catalog loaded: %d items", len(LOCAL_DB_INDEX or ()))
+
+
+def _get_local_db() -> FoodIndex | None:
+    return LOCAL_DB_INDEX
+
+
+def _reload_local_db_if_changed() -> None:
+    if _local_db_source_mtime() != _local_db_mtime:
+        _load_local_db()
 
 # ─────────────────────────── App lifecycle ───────────────────────────
 
+# Streaks are bumped when food is logged; this batch job repairs them after
+# deletions and back-dated entries (0 = never).
+STREAK_RECOMPUTE_SECONDS = float(os.getenv("STREAK_RECOMPUTE_SECONDS", "3600"))
+# Expired/excess rows are deleted from the persistent cache tiers this often.
+CACHE_PRUNE_SECONDS = float(os.getenv("CACHE_PRUNE_SECONDS", "600"))
+
+async def _run_periodically(seconds: float, job) -> None:
+    """Run a blocking job in a worker thread every `seconds`, logging failures."""
+    while True:
+        await asyncio.sleep(seconds)
+        try:
+            await asyncio.to_thread(job)
+        except Exception as e:
+            logger.error("Periodic job %s failed: %s", job.__name__, e)
+
+
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     init_db()
     logger.info("Database initialized. Model: %s", GEMINI_MODEL)
+    try:
+        await asyncio.to_thread(_load_local_db)
+    except Exception as e:
+        logger.error("Local food catalog failed to load: %s", e)
+
+    global _photo_pool
+    if PHOTO_WORKERS > 0:
+        # Forking a process that already runs threads (DB writer, executors) can
+        # deadlock the child, so workers start from a clean interpreter instead
+        method = "forkserver" if "forkserver" in multiprocessing.get_all_start_methods() else "spawn"
+        _photo_pool = ProcessPoolExecutor(
+            max_workers=PHOTO_WORKERS, mp_context=multiprocessing.get_context(method),
+        )
+
+    jobs = [
+        (LOCAL_DB_RELOAD_SECONDS, _reload_local_db_if_changed),
+        (DB_CHECKPOINT_SECONDS, checkpoint_db),
+        (STREAK_RECOMPUTE_SECONDS, recompute_streaks),
+        (CACHE_PRUNE_SECONDS, off_cache.prune),
+        (CACHE_PRUNE_SECONDS, ai_cache.prune),
+    ]
+    tasks = [asyncio.create_task(_run_periodically(sec, job)) for sec, job in jobs if sec > 0]
     yield
+    for task in tasks:
+        task.cancel()
     await http_client.aclose()
+    if _photo_pool is not None:
+        _photo_pool.shutdown(cancel_futures=True)
+    await asyncio.to_thread(checkpoint_db, "TRUNCATE")
+    close_all_connections()
 
 app = FastAPI(
     title="Calorie Tracker API",
@@ -92,6 +257,51 @@ app = FastAPI(
     lifespan=lifespan,
 )
 
+# ─────────────────────────── Upload size limit ───────────────────────────
+
+class UploadLimitMiddleware:
+    """
+    Rejects oversized uploads to `paths` with 413 before the body is parsed:
+    up front from Content-Length, or as soon as a streamed body crosses
+    `max_bytes`, so a large request never gets buffered or spooled in full.
+    """
+
+    def __init__(self, app, paths: set[str], max_bytes: int):
+        self.app = app
+        self.paths = paths
+        self.max_bytes = max_bytes
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["path"] not in self.paths:
+            return await self.app(scope, receive, send)
+
+        content_length = dict(scope["headers"]).get(b"content-length")
+        if content_length is not None and content_length.isdigit() and int(content_length) > self.max_bytes:
+            photo_queue["rejected_too_large"] += 1
+            response = JSONResponse({"detail": "Image too large. Max 10 MB."},
+                                    status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE)
+            return await response(scope, receive, send)
+
+        received = 0
+
+        async def limited_receive():
+            nonlocal received
+            message = await receive()
+            if message["type"] == "http.request":
+                received += len(message.get("body", b""))
+                if received > self.max_bytes:
+                    photo_queue["rejected_too_large"] += 1
+                    # Raised while the form is parsed, so FastAPI turns it into a 413 response
+                    raise HTTPException(status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+                                        detail="Image too large. Max 10 MB.")
+            return message
+
+        await self.app(scope, limited_receive, send)
+
+
+# Multipart framing and form fields on top of the image itself
+app.add_middleware(UploadLimitMiddleware, paths={"/api/analyze-photo"}, max_bytes=PHOTO_MAX_BYTES + 64 * 1024)
+
 # ─────────────────────────── CORS ───────────────────────────
 
 app.add_middleware(
@@ -118,7 +328,19 @@ def _require_user(user_id: int):
 
 @app.api_route("/health", methods=["GET", "HEAD", "POST"])
 def health():
-    return {"status": "ok", "model": GEMINI_MODEL}
+    index = _get_local_db()
+    return {
+        "status": "ok",
+        "model": GEMINI_MODEL,
+        "catalog_ready": index is not None,
+        "catalog_items": len(index) if index is not None else 0,
+        "off_cache": off_cache.stats(),
+        "ai_cache": ai_cache.stats(),
+        "gemini": gemini_scheduler.stats(),
+        "photo_cache": photo_cache.stats(),
+        "photo_queue": {**photo_queue, "concurrency": PHOTO_CONCURRENCY},
+        "photo_preprocessing": {**photo_stats, "bytes_saved": photo_stats["bytes_in"] - photo_stats["bytes_out"]},
+    }
 
 
 # ── 1. Init / upsert user ──────────────────────────────────────────
@@ -225,15 +447,16 @@ def get_stats(user_id: int, date: str | None = None):
     Return today's (or a specific date's) food logs and calorie total.
     Query params: ?user_id=123&date=2026-02-22 (date is optional, defaults to today)
     """
-    user = _require_user(user_id)
-
     from datetime import date as date_cls
     target = date or date_cls.today().isoformat()
 
-    rows = get_logs_by_date(user_id, target) if date else get_today_logs(user_id)
-    water_rows = get_water_by_date(user_id, target)
-
-    streak = update_user_streak(user_id)
+    snapshot = get_day_snapshot(user_id, target)
+    if snapshot is None:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail=f"User {user_id} not found. Call /api/init-user first.",
+        )
+    user, rows, water_rows, totals, streak = snapshot
 
     entries = [
         FoodEntry(
@@ -259,12 +482,12 @@ def get_stats(user_id: int, date: str | None = None):
     return StatsResponse(
         user_id=user_id,
         date=target,
-        total_calories=sum(e.calories for e in entries),
+        total_calories=totals["calories"] if totals else 0,
         calorie_goal=user["calorie_goal"],
-        total_protein=sum(e.protein or 0 for e in entries),
-        total_carbs=sum(e.carbs or 0 for e in entries),
-        total_fat=sum(e.fat or 0 for e in entries),
-        water_ml=sum(w.amount_ml for w in water_entries),
+        total_protein=round(totals["protein"], 1) if totals else 0.0,
+        total_carbs=round(totals["carbs"], 1) if totals else 0.0,
+        total_fat=round(totals["fat"], 1) if totals else 0.0,
+        water_ml=totals["water_ml"] if totals else 0,
         water_goal=user["water_goal"] or 2000,
         streak=streak,
         entries=entries,
@@ -278,22 +501,65 @@ def get_stats(user_id: int, date: str | None = None):
 
 # ── 4. Add food by text ───────────────────────────────────────
 
+async def _match_local_food(text: str) -> dict | None:
+    """
+    Resolve the text against the local catalog when it states a weight or
+    volume and the rest is a near-exact catalog name; values are scaled from
+    per-100 g. Without an explicit weight ("борщ", "2 шт") the portion size is
+    unknown, so that is left to Gemini. Returns a result shaped like FoodAI's, or None.
+    """
+    index = _get_local_db()
+    name, grams, _ = parse_quantity(text)
+    if index is None or not name or grams is None:
+        return None
+
+    match = await asyncio.to_thread(index.best_match, name, LOCAL_MATCH_SCORE)
+    if match is None:
+        return None
+    _, food = match
+
+    factor = grams / 100
+    return {
+        "food": f"{food['food_name']} ({grams:g}г)",
+        "calories": round(food["calories"] * factor),
+        "protein": round(food["protein"] * factor, 1),
+        "carbs": round(food["carbs"] * factor, 1),
+        "fat": round(food["fat"] * factor, 1),
+        "emoji": "🍽️",
+    }
+
+
 @app.post("/api/add-text", response_model=AIFoodResult, status_code=status.HTTP_201_CREATED)
 async def add_text(body: AddTextRequest):
     """
     Pass a text description (e.g. "банан" or "тарелка борща").
     Gemini returns name + calories + macros, which are saved to the DB.
     """
-    _require_user(body.user_id)
+    await run_db(_require_user, body.user_id)
 
-    result = await food_ai.analyze_text(body.text)
+    result = await _match_local_food(body.text)
+    source = "text_local"
+    if result is None:
+        try:
+            result = await food_ai.analyze_text(body.text)
+        except AIUnavailable:
+            raise HTTPException(
+                status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                detail="AI is overloaded right now, please try again in a moment.",
+            )
+        source = "text_ai"
     if result is None:
         raise HTTPException(
             status_code=status.HTTP_422_UNPROCESSABLE_ENTITY,
             detail="Gemini could not identify food in the given text.",
         )
 
-    log_id = add_food_log(
+    return await _log_text_result(body, result, source)
+
+
+async def _log_text_result(body: AddTextRequest, result: dict, source: str) -> AIFoodResult:
+    log_id = await run_db(
+        add_food_log,
         user_id=body.user_id,
         food_name=result["food"],
         calories=int(result["calories"]),
@@ -301,16 +567,112 @@ async def add_text(body: AddTextRequest):
         carbs=result.get("carbs"),
         fat=result.get("fat"),
         emoji=result.get("emoji"),
-        source="text_ai",
+        source=source,
         meal_type=body.meal_type,
         log_date=body.log_date,
     )
+    return AIFoodResult(log_id=log_id, source=source, **result)
 
-    return AIFoodResult(log_id=log_id, **result)
+
+def _sse(event: str, data: dict) -> str:
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+
+@app.post("/api/add-text/stream")
+async def add_text_stream(body: AddTextRequest):
+    """
+    Same as /api/add-text, answered as Server-Sent Events: "partial" events
+    carry fields as Gemini produces them (food name first, then calories and
+    macros), then one "result" event with the saved entry, or an "error"
+    event with the status code add-text would have returned.
+    """
+    await run_db(_require_user, body.user_id)
+
+    async def events():
+        # The response has already started, so failures become "error" events
+        try:
+            result = await _match_local_food(body.text)
+            source = "text_local"
+            if result is None:
+                source = "text_ai"
+                async for kind, value in food_ai.stream_text(body.text):
+                    if kind == "partial":
+                        yield _sse("partial", value)
+                    else:
+                        result = value
+            if result is None:
+                yield _sse("error", {
+                    "status": status.HTTP_422_UNPROCESSABLE_ENTITY,
+                    "detail": "Gemini could not identify food in the given text.",
+                })
+                return
+
+            saved = await _log_text_result(body, result, source)
+            yield _sse("result", saved.model_dump())
+        except AIUnavailable:
+            yield _sse("error", {
+                "status": status.HTTP_503_SERVICE_UNAVAILABLE,
+                "detail": "AI is overloaded right now, please try again in a moment.",
+            })
+        except Exception:
+            logger.exception("add-text stream failed")
+            yield _sse("error", {
+                "status": status.HTTP_500_INTERNAL_SERVER_ERROR,
+                "detail": "Internal server error",
+            })
+
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
 
 
 # ── 5. Analyze photo ─────────────────────────────────────────
 
+async def _prepare_photo(image_bytes: bytes):
+    """Downscale and re-encode an upload off the event loop (see imaging.prepare_photo)."""
+    args = (image_bytes, PHOTO_MAX_DIM, PHOTO_FORMAT, PHOTO_QUALITY)
+    if _photo_pool is None:
+        prepared = await asyncio.to_thread(prepare_photo, *args)
+    else:
+        prepared = await asyncio.get_running_loop().run_in_executor(_photo_pool, prepare_photo, *args)
+
+    if prepared is not None:
+        photo_stats["photos"] += 1
+        photo_stats["bytes_in"] += len(image_bytes)
+        photo_stats["bytes_out"] += len(prepared.data)
+        logger.info("Photo preprocessed: %d → %d bytes (saved %d)",
+                    len(image_bytes), len(prepared.data), len(image_bytes) - len(prepared.data))
+    return prepared
+
+
+async def _analyze_upload(file: UploadFile) -> dict | None:
+    """Read the upload in chunks (stopping past PHOTO_MAX_BYTES), preprocess it and ask Gemini."""
+    chunks = []
+    size = 0
+    while chunk := await file.read(UPLOAD_CHUNK_BYTES):
+        size += len(chunk)
+        if size > PHOTO_MAX_BYTES:
+            raise HTTPException(
+                status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+                detail="Image too large. Max 10 MB.",
+            )
+        chunks.append(chunk)
+    image_bytes = b"".join(chunks)
+    del chunks
+
+    prepared = await _prepare_photo(image_bytes)
+    if prepared is None:
+        raise HTTPException(
+            status_code=status.HTTP_415_UNSUPPORTED_MEDIA_TYPE,
+            detail="Could not decode the image.",
+        )
+    del image_bytes
+
+    return await food_ai.analyze_photo(prepared.data, mime_type=prepared.mime_type, phash=prepared.phash)
+
+
 @app.post("/api/analyze-photo", response_model=AIFoodResult, status_code=status.HTTP_201_CREATED)
 async def analyze_photo(
     user_id: Annotated[int, Form()],
@@ -319,7 +681,7 @@ async def analyze_photo(
     log_date: Annotated[str | None, Form()] = None,
 ):
     """Upload a food photo. Gemini vision identifies the dish and estimates calories."""
-    _require_user(user_id)
+    await run_db(_require_user, user_id)
 
     allowed_mime = {"image/jpeg", "image/png", "image/webp", "image/gif"}
     content_type = file.content_type or "image/jpeg"
@@ -329,21 +691,34 @@ async def analyze_photo(
             detail=f"Unsupported image type: {content_type}. Allowed: {allowed_mime}",
         )
 
-    image_bytes = await file.read()
-    if len(image_bytes) > 10 * 1024 * 1024:
+    queued = _photo_slots.locked()
+    if queued:
+        photo_queue["waiting"] += 1
+        photo_queue["max_waiting"] = max(photo_queue["max_waiting"], photo_queue["waiting"])
+    try:
+        await _photo_slots.acquire()
+    finally:
+        if queued:
+            photo_queue["waiting"] -= 1
+    photo_queue["active"] += 1
+    try:
+        result = await _analyze_upload(file)
+    except AIUnavailable:
         raise HTTPException(
-            status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
-            detail="Image too large. Max 10 MB.",
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="AI is overloaded right now, please try again in a moment.",
         )
-
-    result = await food_ai.analyze_photo(image_bytes, mime_type=content_type)
+    finally:
+        photo_queue["active"] -= 1
+        _photo_slots.release()
     if result is None:
         raise HTTPException(
             status_code=status.HTTP_422_UNPROCESSABLE_ENTITY,
             detail="No food detected in the photo.",
         )
 
-    log_id = add_food_log(
+    log_id = await run_db(
+        add_food_log,
         user_id=user_id,
         food_name=result["food"],
         calories=int(result["calories"]),
@@ -425,51 +800,73 @@ def add_manual(body: ManualFoodRequest):
     )
 
 
+@app.post("/api/add-batch", response_model=list[AIFoodResult], status_code=status.HTTP_201_CREATED)
+def add_batch(body: BatchFoodRequest):
+    """Log several foods (e.g. a whole meal or recipe) in one request and one transaction."""
+    _require_user(body.user_id)
+    items = [item.model_dump() for item in body.items]
+    log_ids = add_food_logs(body.user_id, items, source="manual")
+    return [
+        AIFoodResult(
+            log_id=log_id,
+            food=item.food_name,
+            calories=item.calories,
+            protein=item.protein,
+            carbs=item.carbs,
+            fat=item.fat,
+            emoji=item.emoji,
+        )
+        for log_id, item in zip(log_ids, body.items)
+    ]
+
+
 # ── 10. Barcode Scanner (OpenFoodFacts) ───────────────────────
 
+async def _refresh_barcode(barcode: str) -> None:
+    """Re-resolve a stale local barcode row against OpenFoodFacts."""
+    try:
+        result = await fetch_barcode(http_client, barcode)
+    except OFFUnavailable:
+        return
+    if result is not None:
+        await run_db(upsert_barcode, result)
+        await off_cache.aset(f"barcode:{barcode}", result)
+
+
 @app.get("/api/barcode/{barcode}")
 async def scan_barcode(barcode: str):
-    # Try Russian OpenFoodFacts first, then global
-    urls = [
-        f"https://ru.openfoodfacts.org/api/v0/product/{barcode}.json",
-        f"https://world.openfoodfacts.org/api/v0/product/{barcode}.json",
-    ]
+    barcode = barcode.strip()
+    cache_key = f"barcode:{barcode}"
+    cached = await off_cache.aget(cache_key)
+    if cached is not MISS:
+        if cached is None:
+            raise HTTPException(status_code=404, detail="Продукт не найден в базе штрих-кодов")
+        return cached
+
+    # Local barcode index first; stale rows are served and refreshed in the background
+    row = await run_db(get_barcode, barcode, stale_days=BARCODE_STALE_DAYS)
+    if row:
+        result = {k: row[k] for k in ("food_name", "calories", "protein", "carbs", "fat", "brand", "image_url", "barcode")}
+        if row["stale"]:
+            task = asyncio.create_task(_refresh_barcode(barcode))
+            _background_tasks.add(task)
+            task.add_done_callback(_background_tasks.discard)
+        await off_cache.aset(cache_key, result)
+        return result
 
-    for url in urls:
-        try:
-            resp = await http_client.get(url, headers={"User-Agent": "CalorieTrackerApp/2.0"})
-            if resp.status_code != 200:
-                continue
-
-            data = resp.json()
-            if data.get("status") != 1:
-                continue
-
-            product = data.get("product", {})
-            nutriments = product.get("nutriments", {})
-            calories = nutriments.get("energy-kcal_100g") or nutriments.get("energy-kcal")
-
-            if calories is None:
-                continue
-
-            return {
-                "food_name": (
-                    product.get("product_name_ru")
-                    or product.get("product_name")
-                    or "Неизвестный продукт"
-                ),
-                "calories": int(calories or 0),
-                "protein": float(nutriments.get("proteins_100g") or 0.0),
-                "carbs": float(nutriments.get("carbohydrates_100g") or 0.0),
-                "fat": float(nutriments.get("fat_100g") or 0.0),
-                "brand": product.get("brands", ""),
-                "image_url": product.get("image_url", ""),
-                "barcode": barcode,
-            }
-        except Exception:
-            continue
+    try:
+        result = await fetch_barcode(http_client, barcode)
+    except OFFUnavailable:
+        raise HTTPException(status_code=404, detail="Продукт не найден в базе штрих-кодов")
+
+    if result is None:
+        # Only remember a definite "not found", never a network failure
+        await off_cache.aset_negative(cache_key)
+        raise HTTPException(status_code=404, detail="Продукт не найден в базе штрих-кодов")
 
-    raise HTTPException(status_code=404, detail="Продукт не найден в базе штрих-кодов")
+    await run_db(upsert_barcode, result)
+    await off_cache.aset(cache_key, result)
+    return result
 
 
 # ── 11. Search Food ─────────────────────────────────────────
@@ -527,18 +924,47 @@ def recent_foods(user_id: int):
     ]
 
 
-LOCAL_DB_CACHE = []
-LOCAL_DB_NAMES = []
+async def _search_openfoodfacts(q: str) -> list[dict]:
+    """Query OpenFoodFacts full-text search (Russian/Belarusian products first)."""
+    cache_key = "search:" + " ".join(q.lower().split())
+    cached = await off_cache.aget(cache_key)
+    if cached is not MISS:
+        return cached
 
-def _get_local_db():
-    global LOCAL_DB_CACHE, LOCAL_DB_NAMES
-    if not LOCAL_DB_CACHE:
-        local_db_path = os.path.join(os.path.dirname(__file__), "local_db.json")
-        if os.path.exists(local_db_path):
-            with open(local_db_path, "r", encoding="utf-8") as f:
-                LOCAL_DB_CACHE = json.load(f)
-            LOCAL_DB_NAMES = [lf["food_name"].lower().replace("ё", "е") for lf in LOCAL_DB_CACHE]
-    return LOCAL_DB_CACHE, LOCAL_DB_NAMES
+    q_encoded = urllib.parse.quote(q.strip())
+    off_url = (
+        f"https://world.openfoodfacts.org/cgi/search.pl"
+        f"?search_terms={q_encoded}&search_simple=1&action=process&json=1"
+        f"&page_size=15&lc=ru&cc=ru"
+    )
+
+    resp = await http_client.get(off_url, headers={"User-Agent": "CalorieTrackerApp/2.0"})
+    if resp.status_code != 200:
+        return []
+
+    results = []
+    for p in resp.json().get("products", []):
+        name = p.get("product_name_ru") or p.get("product_name")
+        if not name:
+            continue
+
+        nutriments = p.get("nutriments", {})
+        calories = nutriments.get("energy-kcal_100g")
+        if calories is None:
+            continue
+
+        results.append({
+            "food_name": name,
+            "calories": int(calories or 0),
+            "protein": float(nutriments.get("proteins_100g") or 0.0),
+            "carbs": float(nutriments.get("carbohydrates_100g") or 0.0),
+            "fat": float(nutriments.get("fat_100g") or 0.0),
+            "brand": p.get("brands", ""),
+            "image_url": p.get("image_url", ""),
+            "category": "",
+        })
+    await off_cache.aset(cache_key, results)
+    return results
 
 
 @app.get("/api/search-food")
@@ -547,10 +973,13 @@ async def search_food(q: str, user_id: int | None = None):
     if not q_str:
         return []
 
-    results = []
-    seen = set()
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + OFF_SEARCH_BUDGET_MS / 1000
 
-    # 1. Preprocess query (keyboard layout + transliteration)
+    # 1. Start OpenFoodFacts right away, it is by far the slowest source
+    off_task = asyncio.create_task(_search_openfoodfacts(q))
+
+    # 2. Preprocess query (keyboard layout + transliteration)
     q_kb = q_str.translate(ENG_TO_RUS_KEYBOARD)
     words = q_str.split()
     for i, w in enumerate(words):
@@ -559,101 +988,60 @@ async def search_food(q: str, user_id: int | None = None):
     q_syn = " ".join(words)
     queries = list({q_str, q_kb, q_syn})
 
-    # 2. Search user's custom foods first
-    if user_id:
-        custom_results = search_custom_foods(q_str, limit=5)
-        for cr in custom_results:
-            fname_lower = cr["food_name"].lower()
-            if fname_lower not in seen:
-                results.append({
-                    "food_name": cr["food_name"],
-                    "calories": cr["calories"],
-                    "protein": cr["protein"],
-                    "carbs": cr["carbs"],
-                    "fat": cr["fat"],
-                    "brand": "Мой рецепт 🧑‍🍳",
-                    "image_url": "",
-                    "category": "custom",
-                })
-                seen.add(fname_lower)
-
-    # 3. Search local DB (fuzzy with ё/е normalization)
-    local_foods, local_names = _get_local_db()
-    if local_foods:
-        scored = []
-        for lf, fname_norm in zip(local_foods, local_names):
-            best_score = 0
-            for query in queries:
-                query_norm = query.replace("ё", "е")
-                
-                score_ts = fuzz.token_set_ratio(query_norm, fname_norm)
-                score_w = fuzz.WRatio(query_norm, fname_norm)
-                score = max(score_ts, score_w)
-                
-                if query_norm in fname_norm:
-                    score = max(score, 92)
-                best_score = max(best_score, score)
-
-            if best_score >= 55:
-                scored.append((best_score, lf))
-
-        scored.sort(key=lambda x: x[0], reverse=True)
-
-        for score, lf in scored[:20]:
-            fname_lower = lf["food_name"].lower()
-            if fname_lower not in seen:
-                results.append({
-                    "food_name": lf["food_name"],
-                    "calories": lf["calories"],
-                    "protein": lf["protein"],
-                    "carbs": lf["carbs"],
-                    "fat": lf["fat"],
-                    "brand": lf.get("brand", "Локальная база"),
-                    "image_url": "",
-                    "category": lf.get("category", ""),
-                })
-                seen.add(fname_lower)
-
-    # 4. Try OpenFoodFacts (Russian/Belarusian products first)
-    q_encoded = urllib.parse.quote(q.strip())
-    off_url = (
-        f"https://world.openfoodfacts.org/cgi/search.pl"
-        f"?search_terms={q_encoded}&search_simple=1&action=process&json=1"
-        f"&page_size=15&lc=ru&cc=ru"
+    # 3. User's custom foods and the local DB (fuzzy with ё/е normalization) in parallel
+    index = _get_local_db()
+    custom_results, local_results = await asyncio.gather(
+        run_db(search_custom_foods, q_str, limit=5) if user_id else asyncio.sleep(0, []),
+        asyncio.to_thread(index.search, queries, limit=20) if index else asyncio.sleep(0, []),
     )
 
-    try:
-        resp = await http_client.get(off_url, headers={"User-Agent": "CalorieTrackerApp/2.0"})
-        if resp.status_code == 200:
-            data = resp.json()
-            products = data.get("products", [])
-            for p in products:
-                name = p.get("product_name_ru") or p.get("product_name")
-                if not name:
-                    continue
-
-                name_lower = name.lower().strip()
-                if name_lower in seen:
-                    continue
-
-                nutriments = p.get("nutriments", {})
-                calories = nutriments.get("energy-kcal_100g")
-                if calories is None:
-                    continue
+    results = []
+    seen = set()
 
+    for cr in custom_results:
+        fname_lower = cr["food_name"].lower()
+        if fname_lower not in seen:
+            results.append({
+                "food_name": cr["food_name"],
+                "calories": cr["calories"],
+                "protein": cr["protein"],
+                "carbs": cr["carbs"],
+                "fat": cr["fat"],
+                "brand": "Мой рецепт 🧑‍🍳",
+                "image_url": "",
+                "category": "custom",
+            })
+            seen.add(fname_lower)
+
+    for score, lf in local_results:
+        fname_lower = lf["food_name"].lower()
+        if fname_lower not in seen:
+            results.append({
+                "food_name": lf["food_name"],
+                "calories": lf["calories"],
+                "protein": lf["protein"],
+                "carbs": lf["carbs"],
+                "fat": lf["fat"],
+                "brand": lf.get("brand", "Локальная база"),
+                "image_url": "",
+                "category": lf.get("category", ""),
+            })
+            seen.add(fname_lower)
+
+    # 4. OpenFoodFacts only if it answers within the latency budget
+    done, _ = await asyncio.wait({off_task}, timeout=max(0.0, deadline - loop.time()))
+    if not done:
+        # Let it finish in the background so the next identical query hits off_cache
+        _background_tasks.add(off_task)
+        off_task.add_done_callback(_background_tasks.discard)
+        off_task.add_done_callback(lambda t: t.cancelled() or t.exception())
+        logger.info("OpenFoodFacts search exceeded %d ms budget for %r", OFF_SEARCH_BUDGET_MS, q)
+    elif off_task.exception() is None:
+        for item in off_task.result():
+            name_lower = item["food_name"].lower().strip()
+            if name_lower not in seen:
                 seen.add(name_lower)
-                results.append({
-                    "food_name": name,
-                    "calories": int(calories or 0),
-                    "protein": float(nutriments.get("proteins_100g") or 0.0),
-                    "carbs": float(nutriments.get("carbohydrates_100g") or 0.0),
-                    "fat": float(nutriments.get("fat_100g") or 0.0),
-                    "brand": p.get("brands", ""),
-                    "image_url": p.get("image_url", ""),
-                    "category": "",
-                })
-    except Exception:
-        pass
+                results.append(item)
 
     return results[:30]
 
@@ -662,34 +1050,28 @@ async def search_food(q: str, user_id: int | None = None):
 
 @app.get("/api/stats/weekly", response_model=WeeklyStatsResponse)
 def get_weekly_stats(user_id: int):
-    _require_user(user_id)
+    user = _require_user(user_id)
     from datetime import date as date_cls, timedelta
     today = date_cls.today()
     dates = [(today - timedelta(days=i)).isoformat() for i in range(6, -1, -1)]
 
-    start_date = dates[0]
-    end_date = dates[-1]
-    all_logs = get_logs_by_date_range(user_id, start_date, end_date)
+    totals = {r["date"]: r for r in get_daily_totals_range(user_id, dates[0], dates[-1])}
 
     weekly_calories = [0] * 7
     weekly_protein = [0.0] * 7
     weekly_carbs = [0.0] * 7
     weekly_fat = [0.0] * 7
 
-    for log in all_logs:
-        try:
-            day_idx = dates.index(log["date"])
-            weekly_calories[day_idx] += log["calories"]
-            weekly_protein[day_idx] += log["protein"] or 0
-            weekly_carbs[day_idx] += log["carbs"] or 0
-            weekly_fat[day_idx] += log["fat"] or 0
-        except ValueError:
-            pass
-
-    streak = update_user_streak(user_id)
+    for day_idx, day in enumerate(dates):
+        if day in totals:
+            weekly_calories[day_idx] = totals[day]["calories"]
+            weekly_protein[day_idx] = totals[day]["protein"]
+            weekly_carbs[day_idx] = totals[day]["carbs"]
+            weekly_fat[day_idx] = totals[day]["fat"]
+
     return WeeklyStatsResponse(
         user_id=user_id,
-        streak=streak,
+        streak=effective_streak(user),
         weekly_calories=weekly_calories,
         dates=dates,
         weekly_protein=[round(p, 1) for p in weekly_protein],
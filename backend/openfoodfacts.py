@@ -0,0 +1,185 @@
+"""
+openfoodfacts.py — OpenFoodFacts barcode lookups and dump import
+
+Import a product dump into the local barcodes table:
+    python openfoodfacts.py en.openfoodfacts.org.products.csv[.gz]
+    python openfoodfacts.py openfoodfacts-products.jsonl[.gz]
+"""
+
+import asyncio
+import csv
+import gzip
+import json
+import sys
+import time
+from collections.abc import Iterator
+
+import httpx
+
+HEADERS = {"User-Agent": "CalorieTrackerApp/2.0"}
+
+# Barcode endpoints queried concurrently, with per-host timeouts in seconds
+BARCODE_URLS = {
+    "https://ru.openfoodfacts.org/api/v0/product/{barcode}.json": 4.0,
+    "https://world.openfoodfacts.org/api/v0/product/{barcode}.json": 6.0,
+}
+
+
+class OFFUnavailable(Exception):
+    """No OpenFoodFacts host gave a definite answer (network errors, 5xx, open circuit)."""
+
+
+class CircuitBreaker:
+    """
+    Stops calling a host after `failure_threshold` consecutive failures.
+    Once `reset_after` seconds have passed, one trial request is let through;
+    a success closes the circuit again, a failure keeps it open.
+    """
+
+    def __init__(self, failure_threshold: int = 3, reset_after: float = 30.0):
+        self.failure_threshold = failure_threshold
+        self.reset_after = reset_after
+        self.failures = 0
+        self.opened_at: float | None = None
+
+    def allow(self) -> bool:
+        if self.opened_at is None:
+            return True
+        if time.monotonic() - self.opened_at >= self.reset_after:
+            self.opened_at = time.monotonic()  # half-open: one trial per window
+            return True
+        return False
+
+    def record_success(self) -> None:
+        self.failures = 0
+        self.opened_at = None
+
+    def record_failure(self) -> None:
+        self.failures += 1
+        if self.failures >= self.failure_threshold:
+            self.opened_at = time.monotonic()
+
+
+_breakers = {url: CircuitBreaker() for url in BARCODE_URLS}
+
+
+def parse_product(product: dict, barcode: str) -> dict | None:
+    """Turn an OFF product object into our barcode result, or None without calories."""
+    nutriments = product.get("nutriments", {})
+    calories = nutriments.get("energy-kcal_100g") or nutriments.get("energy-kcal")
+    if calories is None:
+        return None
+
+    return {
+        "food_name": (
+            product.get("product_name_ru")
+            or product.get("product_name")
+            or "Неизвестный продукт"
+        ),
+        "calories": int(float(calories or 0)),
+        "protein": float(nutriments.get("proteins_100g") or 0.0),
+        "carbs": float(nutriments.get("carbohydrates_100g") or 0.0),
+        "fat": float(nutriments.get("fat_100g") or 0.0),
+        "brand": product.get("brands", ""),
+        "image_url": product.get("image_url", ""),
+        "barcode": barcode,
+    }
+
+
+async def _fetch_from(client: httpx.AsyncClient, url: str, barcode: str) -> dict | None:
+    """Ask one host. None means a definite "unknown product"; errors raise."""
+    resp = await client.get(url.format(barcode=barcode), headers=HEADERS, timeout=BARCODE_URLS[url])
+    if resp.status_code == 404:
+        return None
+    if resp.status_code != 200:
+        raise OFFUnavailable(f"{url}: HTTP {resp.status_code}")
+
+    data = resp.json()
+    if data.get("status") != 1:
+        return None
+    return parse_product(data.get("product", {}), barcode)
+
+
+async def fetch_barcode(client: httpx.AsyncClient, barcode: str) -> dict | None:
+    """
+    Look the barcode up on all OpenFoodFacts hosts at once; the first valid
+    product wins and the remaining requests are cancelled. Hosts with an
+    open circuit are skipped.
+    Returns None when every host definitely doesn't know the product,
+    raises OFFUnavailable when at least one host couldn't be asked.
+    """
+    tasks = {
+        asyncio.create_task(_fetch_from(client, url, barcode)): breaker
+        for url, breaker in _breakers.items()
+        if breaker.allow()
+    }
+    failed = len(tasks) < len(_breakers)
+
+    pending = set(tasks)
+    try:
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                breaker = tasks[task]
+                try:
+                    result = task.result()
+                except Exception:
+                    breaker.record_failure()
+                    failed = True
+                    continue
+                breaker.record_success()
+                if result is not None:
+                    return result
+    finally:
+        for task in pending:
+            task.cancel()
+
+    if failed:
+        raise OFFUnavailable(barcode)
+    return None
+
+
+# ─────────────────────────── Dump import ───────────────────────────
+
+def _open_text(path: str):
+    if path.endswith(".gz"):
+        return gzip.open(path, "rt", encoding="utf-8")
+    return open(path, "r", encoding="utf-8")
+
+
+def iter_dump(path: str) -> Iterator[dict]:
+    """Yield parsed products from an OFF CSV (tab-separated) or JSONL dump."""
+    csv.field_size_limit(sys.maxsize)
+    with _open_text(path) as f:
+        if ".jsonl" in path:
+            for line in f:
+                try:
+                    product = json.loads(line)
+                    code = product.get("code")
+                    result = parse_product(product, code) if code else None
+                except ValueError:
+                    continue  # truncated line or malformed numeric field
+                if result:
+                    yield result
+        else:
+            for row in csv.DictReader(f, delimiter="\t", quoting=csv.QUOTE_NONE):
+                code = row.get("code")
+                if not code:
+                    continue
+                nutriments = {k: v for k, v in row.items() if k.endswith("_100g") and v}
+                try:
+                    result = parse_product({**row, "nutriments": nutriments}, code)
+                except ValueError:
+                    continue  # malformed numeric column
+                if result:
+                    yield result
+
+
+if __name__ == "__main__":
+    from database import import_barcodes, init_db
+
+    if len(sys.argv) != 2:
+        sys.exit(__doc__)
+    init_db()
+    count = import_barcodes(iter_dump(sys.argv[1]))
+    print(f"Imported {count} products.")
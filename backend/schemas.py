@@ -2,7 +2,7 @@
 schemas.py — Pydantic request/response schemas for Calorie Tracker API
 """
 
-from pydantic import BaseModel
+from pydantic import BaseModel, Field
 from typing import Optional
 
 
@@ -76,6 +76,8 @@ class AIFoodResult(BaseModel):
     carbs: Optional[float] = None
     fat: Optional[float] = None
     emoji: Optional[str] = None
+    # How the food was resolved, e.g. "text_local" (catalog) or "text_ai" (Gemini)
+    source: Optional[str] = None
 
 
 class AddTextRequest(BaseModel):
@@ -85,8 +87,7 @@ class AddTextRequest(BaseModel):
     log_date: Optional[str] = None
 
 
-class ManualFoodRequest(BaseModel):
-    user_id: int
+class ManualFoodItem(BaseModel):
     food_name: str
     calories: int
     protein: Optional[float] = None
@@ -97,6 +98,15 @@ class ManualFoodRequest(BaseModel):
     log_date: Optional[str] = None
 
 
+class ManualFoodRequest(ManualFoodItem):
+    user_id: int
+
+
+class BatchFoodRequest(BaseModel):
+    user_id: int
+    items: list[ManualFoodItem] = Field(min_length=1, max_length=100)
+
+
 class CustomFoodRequest(BaseModel):
     user_id: int
     food_name: str
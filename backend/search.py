@@ -0,0 +1,185 @@
+"""
+search.py — In-memory index over the local food catalog for /api/search-food
+"""
+
+import heapq
+import re
+from collections import defaultdict
+from array import array
+
+import numpy as np
+from rapidfuzz import fuzz, process
+
+from catalog import Catalog
+
+# Upper bound on how many catalog items are handed to rapidfuzz per query.
+MAX_CANDIDATES = 300
+# Queries this short (after normalization) skip the trigram prefilter.
+SHORT_QUERY_LEN = 2
+# Minimum fuzzy score for a catalog item to be returned.
+MIN_SCORE = 55
+# A query that is a plain substring of the name scores at least this much.
+SUBSTRING_SCORE = 92
+# rapidfuzz worker threads for cdist (-1 = all cores).
+SCORER_WORKERS = -1
+
+# "200г", "0,5 кг", "250 мл", "2 шт" — one amount with a unit, anywhere in the text.
+_QUANTITY_RE = re.compile(
+    r"(?<!\w)(\d+(?:[.,]\d+)?)\s*(кг|килограмм\w*|г|гр|грамм\w*|л|литр\w*|мл|шт|штук\w*)\.?(?!\w)",
+    re.IGNORECASE,
+)
+_UNIT_GRAMS = {"кг": 1000, "килограмм": 1000, "л": 1000, "литр": 1000}
+
+
+def normalize_name(text: str) -> str:
+    """Lowercase and fold ё → е, the same way names are compared everywhere."""
+    return text.lower().replace("ё", "е")
+
+
+def _trigrams(text: str) -> set[str]:
+    """
+    Word-level trigrams padded with two leading spaces and one trailing space,
+    so "ко" yields {"  к", " ко", "ко "} — the leading grams double as a prefix index.
+    """
+    grams = set()
+    for word in text.split():
+        padded = f"  {word} "
+        for i in range(len(padded) - 2):
+            grams.add(padded[i:i + 3])
+    return grams
+
+
+def parse_quantity(text: str) -> tuple[str, float | None, float | None]:
+    """
+    Split a quantity off a food description.
+    Returns (rest of the text, grams, pieces); millilitres count as grams and
+    at most one of grams/pieces is set.
+    """
+    match = _QUANTITY_RE.search(text)
+    if not match:
+        return text.strip(), None, None
+
+    amount = float(match.group(1).replace(",", "."))
+    unit = match.group(2).lower()
+    rest = " ".join((text[:match.start()] + " " + text[match.end():]).split()).strip(" ,.-")
+    if unit.startswith("шт"):
+        return rest, None, amount
+    for prefix, factor in _UNIT_GRAMS.items():
+        if unit == prefix or (len(prefix) > 2 and unit.startswith(prefix)):
+            return rest, amount * factor, None
+    return rest, amount, None
+
+
+class FoodIndex:
+    """
+    Trigram inverted index built once over the catalog names.
+    `candidates()` narrows the catalog to the items sharing the most grams with
+    the query so that fuzzy scoring only runs on a few hundred entries.
+    """
+
+    def __init__(self, foods: Catalog):
+        self.foods = foods
+        self.names = [normalize_name(name) for name in foods.food_names()]
+        self._names_arr = np.array(self.names)
+
+        postings: dict[str, list[int]] = defaultdict(list)
+        for idx, name in enumerate(self.names):
+            for gram in _trigrams(name):
+                postings[gram].append(idx)
+        self._postings = {gram: array("I", ids) for gram, ids in postings.items()}
+
+    def __len__(self) -> int:
+        return len(self.foods)
+
+    def candidates(self, queries: list[str], limit: int = MAX_CANDIDATES) -> list[int]:
+        """
+        Return catalog positions of the `limit` items sharing the most trigrams
+        with any of the queries, in catalog order.
+        """
+        grams = set()
+        for query in queries:
+            grams |= _trigrams(normalize_name(query))
+
+        hits: dict[int, int] = defaultdict(int)
+        for gram in grams:
+            for idx in self._postings.get(gram, ()):
+                hits[idx] += 1
+
+        if len(hits) <= limit:
+            return sorted(hits)
+        return sorted(heapq.nlargest(limit, hits, key=hits.__getitem__))
+
+    def best_match(self, query: str, min_score: float) -> tuple[float, dict] | None:
+        """
+        The catalog item whose whole name is most similar to `query` (plain
+        `fuzz.ratio`, so extra or missing words lower the score), or None when
+        nothing reaches `min_score`.
+        """
+        if len(normalize_name(query).strip()) <= SHORT_QUERY_LEN:
+            positions = range(len(self.names))
+        else:
+            positions = self.candidates([query])
+        if not positions:
+            return None
+        match = process.extractOne(
+            normalize_name(query).strip(),
+            [self.names[i] for i in positions],
+            scorer=fuzz.ratio,
+            score_cutoff=min_score,
+        )
+        if match is None:
+            return None
+        _, score, pos = match
+        return score, self.foods[positions[pos]]
+
+    def search(self, queries: list[str], limit: int = 20) -> list[tuple[float, dict]]:
+        """
+        Score every query variant against the candidate names in one native
+        `cdist` call per scorer and return the best `limit` (score, food) pairs.
+        An item's score is the best over all variants of
+        max(token_set_ratio, WRatio), bumped to SUBSTRING_SCORE on a substring hit.
+
+        Queries of up to SHORT_QUERY_LEN characters share too few trigrams with
+        the names they match, and a candidate set that doesn't fill `limit` may
+        have missed weaker matches, so both cases score the whole catalog.
+        Otherwise an item outside the candidates can still outrank a returned
+        one on fuzzy score alone; substring hits are never missed.
+        """
+        queries_norm = [normalize_name(q) for q in queries]
+        everything = np.arange(len(self.names), dtype=np.intp)
+        if any(len(q.strip()) <= SHORT_QUERY_LEN for q in queries_norm):
+            return self._score(everything, queries_norm, limit)
+
+        # Substring hits score at least SUBSTRING_SCORE wherever the query
+        # falls inside a word, so they are always candidates
+        contains = np.zeros(everything.size, dtype=bool)
+        for query in queries_norm:
+            contains |= np.char.find(self._names_arr, query) >= 0
+        positions = np.union1d(
+            np.array(self.candidates(queries), dtype=np.intp), np.flatnonzero(contains),
+        )
+        results = self._score(positions, queries_norm, limit)
+        if len(results) < limit and positions.size < everything.size:
+            results = self._score(everything, queries_norm, limit)
+        return results
+
+    def _score(self, positions: np.ndarray, queries_norm: list[str], limit: int) -> list[tuple[float, dict]]:
+        if not positions.size:
+            return []
+
+        names = self._names_arr[positions]
+        scores = np.maximum(
+            process.cdist(queries_norm, names, scorer=fuzz.token_set_ratio, workers=SCORER_WORKERS),
+            process.cdist(queries_norm, names, scorer=fuzz.WRatio, workers=SCORER_WORKERS),
+        )
+        for row, query in enumerate(queries_norm):
+            contains = np.char.find(names, query) >= 0
+            scores[row, contains] = np.maximum(scores[row, contains], SUBSTRING_SCORE)
+        best = scores.max(axis=0)
+
+        keep = np.flatnonzero(best >= MIN_SCORE)
+        if keep.size > limit:
+            keep = keep[np.argpartition(-best[keep], limit - 1)[:limit]]
+        # Highest score first; ties keep catalog order.
+        keep = keep[np.lexsort((positions[keep], -best[keep]))]
+        return [(float(best[i]), self.foods[positions[i]]) for i in keep]
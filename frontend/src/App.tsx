@@ -9,7 +9,7 @@ import { Toast, ToastMessage } from './components/Toast';
 import { FoodItem } from './components/FoodCard';
 import { useTelegram } from './hooks/useTelegram';
 import { ThemeProvider } from './contexts/ThemeContext';
-import { initUser, getStats, completeOnboarding, addManual, deleteFood, logWater as apiAddWater } from './api';
+import { initUser, getStats, completeOnboarding, addBatch, deleteFood, logWater as apiAddWater } from './api';
 
 type Screen = 'dashboard' | 'progress' | 'add' | 'profile';
 
@@ -210,15 +210,14 @@ function AppInner() {
                             if (localFoods.length > 0) {
                                 setFoods(localFoods);
                                 // Re-sync local foods to server in background if server DB was reset
-                                localFoods.forEach(f => {
-                                    addManual(user.id, {
-                                        food_name: f.name,
-                                        calories: f.calories,
-                                        protein: f.protein || 0,
-                                        carbs: f.carbs || 0,
-                                        fat: f.fat || 0,
-                                    }, f.meal_type || 'any', selectedDate).catch(console.error);
-                                });
+                                addBatch(user.id, localFoods.map(f => ({
+                                    food_name: f.name,
+                                    calories: f.calories,
+                                    protein: f.protein || 0,
+                                    carbs: f.carbs || 0,
+                                    fat: f.fat || 0,
+                                    meal_type: f.meal_type || 'any',
+                                })), selectedDate).catch(console.error);
                             }
                         } catch (e) {}
                     }
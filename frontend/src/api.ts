@@ -87,6 +87,8 @@ export interface AIFoodResult {
     fat: number | null;
     emoji: string | null;
     log_id: number;
+    /** "text_local" when matched in the local catalog, "text_ai" when Gemini answered */
+    source?: string | null;
 }
 
 export interface FoodSearchResult {
@@ -228,6 +230,62 @@ export async function addByText(
     });
 }
 
+/**
+ * Same as addByText, but streamed over Server-Sent Events: `onPartial` gets
+ * the fields recognised so far (name first, then calories and macros)
+ * before the saved entry is returned.
+ */
+export async function addByTextStream(
+    userId: number,
+    text: string,
+    onPartial: (fields: Partial<AIFoodResult>) => void,
+    mealType: string = 'any',
+    logDate?: string
+): Promise<AIFoodResult> {
+    const controller = new AbortController();
+    const timeoutId = setTimeout(() => controller.abort(), 30000);
+    try {
+        const res = await fetch(`${BASE_URL}/api/add-text/stream`, {
+            method: 'POST',
+            headers: { 'Content-Type': 'application/json' },
+            body: JSON.stringify({ user_id: userId, text, meal_type: mealType, log_date: logDate }),
+            signal: controller.signal,
+        });
+        if (!res.ok || !res.body) {
+            const err = await res.json().catch(() => ({ detail: res.statusText }));
+            throw new Error(err.detail ?? 'API error');
+        }
+
+        const reader = res.body.getReader();
+        const decoder = new TextDecoder();
+        let buffer = '';
+        let fields: Partial<AIFoodResult> = {};
+        for (;;) {
+            const { done, value } = await reader.read();
+            if (done) break;
+            buffer += decoder.decode(value, { stream: true });
+            let sep: number;
+            while ((sep = buffer.indexOf('\n\n')) >= 0) {
+                const frame = buffer.slice(0, sep);
+                buffer = buffer.slice(sep + 2);
+                const event = frame.match(/^event: (.*)$/m)?.[1];
+                const data = JSON.parse(frame.match(/^data: (.*)$/m)?.[1] ?? 'null');
+                if (event === 'partial') {
+                    fields = { ...fields, ...data };
+                    onPartial(fields);
+                } else if (event === 'result') {
+                    return data as AIFoodResult;
+                } else if (event === 'error') {
+                    throw new Error(data?.detail ?? 'API error');
+                }
+            }
+        }
+        throw new Error('Stream ended without a result');
+    } finally {
+        clearTimeout(timeoutId);
+    }
+}
+
 /** Upload a food photo; Gemini identifies the dish. */
 export async function analyzePhoto(
     userId: number,
@@ -315,6 +373,39 @@ export async function addManual(
     });
 }
 
+/** Server-side cap on items per /api/add-batch request */
+const BATCH_MAX_ITEMS = 100;
+
+/** Log several foods (per-100g values scaled by `grams`), in as few requests as the server cap allows */
+export async function addBatch(
+    userId: number,
+    items: Array<Partial<FoodSearchResult> & { grams?: number; meal_type?: string }>,
+    logDate?: string
+): Promise<AIFoodResult[]> {
+    const payload = items.map((food) => {
+        const factor = (food.grams ?? 100) / 100;
+        return {
+            food_name: food.food_name || 'Неизвестно',
+            calories: Math.round((food.calories || 0) * factor),
+            protein: Math.round(((food.protein || 0) * factor) * 10) / 10,
+            carbs: Math.round(((food.carbs || 0) * factor) * 10) / 10,
+            fat: Math.round(((food.fat || 0) * factor) * 10) / 10,
+            emoji: '🍽️',
+            meal_type: food.meal_type || 'any',
+            log_date: logDate,
+        };
+    });
+
+    const saved: AIFoodResult[] = [];
+    for (let i = 0; i < payload.length; i += BATCH_MAX_ITEMS) {
+        saved.push(...await request<AIFoodResult[]>('/api/add-batch', {
+            method: 'POST',
+            body: JSON.stringify({ user_id: userId, items: payload.slice(i, i + BATCH_MAX_ITEMS) }),
+        }));
+    }
+    return saved;
+}
+
 /** Create a custom food / recipe */
 export async function createCustomFood(
     userId: number,
@@ -4,7 +4,7 @@ import { FoodItem } from '../components/FoodCard';
 import { GramCalculatorSheet } from '../components/GramCalculatorSheet';
 import { RecipeCalculator } from './RecipeCalculator';
 import { useTelegram } from '../hooks/useTelegram';
-import { addByText, analyzePhoto, scanBarcode, searchFood, FoodSearchResult, addManual, getRecentFoods, RecentFoodResult, getFavorites, addFavorite, removeFavorite, FavoriteItem } from '../api';
+import { addByTextStream, analyzePhoto, scanBarcode, searchFood, FoodSearchResult, addManual, getRecentFoods, RecentFoodResult, getFavorites, addFavorite, removeFavorite, FavoriteItem } from '../api';
 
 type Tab = 'search' | 'text' | 'photo' | 'barcode' | 'recipe' | 'favorites';
 type AIState = 'idle' | 'uploading' | 'analyzing' | 'done' | 'error';
@@ -140,8 +140,18 @@ export const AddFood: React.FC<AddFoodProps> = ({ onAdd, onBack, selectedDate, s
         if (!smartText.trim() || !user?.id) return;
         tapImpact();
         setAiState('analyzing');
+        setAiResult(null);
         try {
-            const res = await addByText(user.id, smartText.trim(), selectedMealType, selectedDate);
+            const res = await addByTextStream(user.id, smartText.trim(), (fields) => {
+                setAiResult({
+                    name: fields.food,
+                    calories: fields.calories,
+                    protein: fields.protein ?? undefined,
+                    carbs: fields.carbs ?? undefined,
+                    fat: fields.fat ?? undefined,
+                    emoji: fields.emoji ?? undefined,
+                });
+            }, selectedMealType, selectedDate);
             const realResult: Partial<FoodItem> = {
                 id: res.log_id.toString(),
                 name: res.food,
@@ -541,9 +551,11 @@ export const AddFood: React.FC<AddFoodProps> = ({ onAdd, onBack, selectedDate, s
                                 </div>
                             </div>
                             <h3 className="text-lg font-bold text-gray-800">
-                                ИИ анализирует текст...
+                                {aiResult?.name ?? 'ИИ анализирует текст...'}
                             </h3>
-                            <p className="text-sm text-gray-400 mt-1">Определяем калории и состав</p>
+                            <p className="text-sm text-gray-400 mt-1">
+                                {aiResult?.calories !== undefined ? `${aiResult.calories} ккал` : 'Определяем калории и состав'}
+                            </p>
                         </div>
                     ) : aiState === 'done' && aiResult ? (
                         <div className="card mb-4 animate-slide-up">